@@ -6,13 +6,31 @@ from django.utils.safestring import mark_safe
 from django.utils.translation import gettext_lazy as _
 from nested_inline.admin import NestedModelAdmin, NestedStackedInline
 
+from apps import counters
 from apps.models import (Certificate, Course, DeletedUser, Device, Lesson,
                          LessonQuestion, Module, Payment, Task, TaskChat, User,
-                         UserCourse, UserLesson, UserModule, UserTask, Video, )
+                         UserCourse, UserCourseProgress, UserLesson, UserModule,
+                         UserTask, Video, )
 from apps.proxies import (AdminUserProxy, AssistantUserProxy, StudentUserProxy,
                           TeacherUserProxy, )
 
 
+class DeferredCountersAdminMixin:
+    """Write the counter changes of one admin save or delete as one UPDATE per parent row."""
+
+    def changeform_view(self, *args, **kwargs):
+        with counters.deferred():
+            return super().changeform_view(*args, **kwargs)
+
+    def delete_view(self, *args, **kwargs):
+        with counters.deferred():
+            return super().delete_view(*args, **kwargs)
+
+    def delete_queryset(self, request, queryset):
+        with counters.deferred():
+            super().delete_queryset(request, queryset)
+
+
 @admin.register(User)
 class CustomUserAdmin(UserAdmin):
     list_display = ("phone_number", "image_tag", "first_name", "last_name", "is_staff", 'type')
@@ -234,7 +252,7 @@ class ModuleStackedInline(NestedStackedInline):
 
 
 @admin.register(Course)
-class CoursesAdminAdmin(NestedModelAdmin):
+class CoursesAdminAdmin(DeferredCountersAdminMixin, NestedModelAdmin):
     inlines = [ModuleStackedInline]
     readonly_fields = ['lesson_count', 'modul_count', 'task_count']
     list_display = ('title', 'modul_count', 'lesson_count', 'task_count')
@@ -246,6 +264,13 @@ class TasksChatAdmin(ModelAdmin):
     pass
 
 
+@admin.register(UserCourseProgress)
+class UserCourseProgressAdmin(ModelAdmin):
+    list_display = ('user', 'course', 'finished_lessons', 'finished_tasks')
+    list_select_related = ('user', 'course')
+    raw_id_fields = ('user', 'course', 'next_lesson')
+
+
 @admin.register(UserModule)
 class UserModuleAdmin(ModelAdmin):
     list_display = ('user', 'module')
@@ -259,7 +284,7 @@ class UserLessonAdmin(ModelAdmin):
 
 
 @admin.register(Video)
-class VideosAdmin(ModelAdmin):
+class VideosAdmin(DeferredCountersAdminMixin, ModelAdmin):
     list_display = ("lesson",)
     pass
 
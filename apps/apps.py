@@ -4,3 +4,11 @@ from django.apps import AppConfig
 class AppsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps'
+
+    def ready(self):
+        import apps.signals  # noqa
+        from django.db.backends.signals import connection_created
+
+        from apps.metrics import instrument_connection, instrument_serializers
+        instrument_serializers()
+        connection_created.connect(instrument_connection)
@@ -0,0 +1,150 @@
+import base64
+import uuid
+
+from asgiref.sync import sync_to_async
+from django.db.models import Count, Max, Q
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from rest_framework.renderers import JSONRenderer
+
+from apps import unread
+from apps.cache import get_enrolled_course_ids
+from apps.chat.auth import get_user
+from apps.middleware import jwt_user_id
+from apps.mixins import conditional_validators, set_validators
+from apps.models import Course, Lesson, Task, User, UserLesson
+from apps.paginations import OrderCursorPagination
+from apps.serializers import (CourseModelSerializer, LessonDetailModelSerializer,
+                              MyUserModelSerializer, TaskModelSerializer, )
+
+MAX_PAGE_SIZE = 500
+
+
+def json_response(content, status=200):
+    return HttpResponse(content, status=status, content_type='application/json')
+
+
+def error(detail, status):
+    return json_response(JSONRenderer().render({'detail': detail}), status)
+
+
+async def authenticate(request):
+    """Return (user id, None) for the token's active user, else (None, a 401 response)."""
+    user_id = jwt_user_id(request)
+    if user_id is None:
+        return None, error('Authentication credentials were not provided.', 401)
+    # Cached briefly, so deactivated users lose access within a minute like on the websockets
+    if await sync_to_async(get_user, thread_sensitive=False)(user_id) is None:
+        return None, error('User not found', 401)
+    return user_id, None
+
+
+async def render(serializer):
+    # File fields build storage URLs; keep that off the event loop and the shared sync thread
+    data = await sync_to_async(lambda: serializer.data, thread_sensitive=False)()
+    return JSONRenderer().render(data)
+
+
+async def conditional(request, validators, build):
+    """Async twin of ConditionalGetMixin: 304 when the validators match, else await build()."""
+    etag, timestamp = conditional_validators(request, *validators)
+    response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+    if response is None:
+        response = await build()
+    return set_validators(response, etag, timestamp)
+
+
+def encode_cursor(course):
+    return base64.urlsafe_b64encode(f'{course.order}|{course.pk}'.encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        order, pk = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return int(order), uuid.UUID(pk)
+    except ValueError:
+        return None
+
+
+async def course_list(request):
+    """Courses in catalog order, paginated by an opaque (order, id) cursor."""
+    try:
+        page_size = min(int(request.GET.get('page_size', OrderCursorPagination.page_size)), MAX_PAGE_SIZE)
+    except ValueError:
+        return error('Invalid page size.', 400)
+    queryset = Course.objects.order_by('order', 'id')
+    if cursor := request.GET.get('cursor'):
+        position = decode_cursor(cursor)
+        if position is None:
+            return error('Invalid cursor', 404)
+        order, pk = position
+        queryset = queryset.filter(Q(order__gt=order) | Q(order=order, id__gt=pk))
+
+    async def build():
+        courses = [course async for course in queryset[:page_size + 1]]
+        next_url = None
+        if len(courses) > page_size:
+            courses = courses[:page_size]
+            query = request.GET.copy()
+            query['cursor'] = encode_cursor(courses[-1])
+            next_url = request.build_absolute_uri(f'{request.path}?{query.urlencode()}')
+        data = await sync_to_async(lambda: CourseModelSerializer(courses, many=True).data,
+                                   thread_sensitive=False)()
+        return json_response(JSONRenderer().render({'next': next_url, 'results': data}))
+
+    stats = await Course.objects.aaggregate(last_modified=Max('update_at'), count=Count('id'))
+    return await conditional(request, ((stats['count'],), stats['last_modified']), build)
+
+
+async def lesson_detail(request, pk):
+    user_id, response = await authenticate(request)
+    if response:
+        return response
+    try:
+        lesson = await Lesson.objects.select_related('module').prefetch_related('video_set').aget(pk=pk)
+    except Lesson.DoesNotExist:
+        return error('Not found.', 404)
+    if lesson.module.course_id not in await sync_to_async(get_enrolled_course_ids)(user_id):
+        return error('You do not have permission to perform this action.', 403)
+
+    async def build():
+        return json_response(await render(LessonDetailModelSerializer(lesson)))
+
+    videos = [video.update_at for video in lesson.video_set.all()]
+    last_modified = max([lesson.update_at, *videos])
+    return await conditional(request, ((lesson.update_at, len(videos), max(videos, default=None)), last_modified),
+                             build)
+
+
+async def user_tasks(request, lesson_id):
+    user_id, response = await authenticate(request)
+    if response:
+        return response
+    if not await UserLesson.objects.filter(user_id=user_id, lesson_id=lesson_id).aexists():
+        return json_response(JSONRenderer().render({'msg': 'Bu lessonga access yoq'}), 403)
+    queryset = Task.objects.filter(lesson_id=lesson_id, must_complete=False).order_by('order')
+
+    async def build():
+        tasks = [task async for task in queryset]
+        return json_response(await render(TaskModelSerializer(tasks, many=True)))
+
+    stats = await queryset.aaggregate(last_modified=Max('update_at'), count=Count('id'))
+    return await conditional(request, ((stats['count'],), stats['last_modified']), build)
+
+
+async def get_me(request):
+    user_id = jwt_user_id(request)
+    if user_id is None:
+        return error('Authentication credentials were not provided.', 401)
+    try:
+        user = await User.objects.only('first_name', 'last_name', 'photo').aget(pk=user_id, is_active=True)
+    except User.DoesNotExist:
+        return error('User not found', 401)
+
+    count = await sync_to_async(unread.total, thread_sensitive=False)(user.pk)
+
+    async def build():
+        return json_response(await render(MyUserModelSerializer(user, context={'unread': count})))
+
+    return await conditional(request, ((user.pk, user.first_name, user.last_name, user.photo.name, count), None),
+                             build)
@@ -0,0 +1,109 @@
+import io
+import json
+
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models.constants import OnConflict
+
+from apps.enrollment import BATCH_SIZE
+
+
+def _csv_value(value):
+    # COPY ... CSV reads an unquoted empty field as NULL and "" as an empty string
+    if value is None:
+        return ''
+    return '"' + str(value).replace('"', '""') + '"'
+
+
+def copy_insert(model, objs, using=DEFAULT_DB_ALIAS, raw=False, upsert=False):
+    """
+    Insert model instances with Postgres COPY FROM STDIN. Primary keys must already be set;
+    values go through pre_save/get_db_prep_save like bulk_create, but no signals are sent.
+    With raw=True auto_now fields keep the values they were given, as in loaddata. With
+    upsert=True rows are copied into a temporary table first and rows whose primary key
+    already exists are updated, as loaddata does.
+    """
+    connection = connections[using]
+    fields = model._meta.concrete_fields
+    buffer = io.StringIO()
+    for obj in objs:
+        values = (field.get_db_prep_save(getattr(obj, field.attname) if raw else field.pre_save(obj, True),
+                                         connection) for field in fields)
+        buffer.write(','.join(_csv_value(value) for value in values))
+        buffer.write('\n')
+    buffer.seek(0)
+    quote = connection.ops.quote_name
+    table = quote(model._meta.db_table)
+    columns = ', '.join(quote(field.column) for field in fields)
+    with connection.cursor() as cursor:
+        if not upsert:
+            cursor.copy_expert(f'COPY {table} ({columns}) FROM STDIN WITH (FORMAT csv)', buffer)
+            return
+        stage = quote(f'stage_{model._meta.db_table}')
+        updates = ', '.join(f'{quote(field.column)} = EXCLUDED.{quote(field.column)}'
+                            for field in fields if not field.primary_key)
+        cursor.execute(f'CREATE TEMPORARY TABLE IF NOT EXISTS {stage} (LIKE {table}) ON COMMIT DROP')
+        cursor.copy_expert(f'COPY {stage} ({columns}) FROM STDIN WITH (FORMAT csv)', buffer)
+        cursor.execute(f'INSERT INTO {table} ({columns}) SELECT {columns} FROM {stage} '
+                       f'ON CONFLICT ({quote(model._meta.pk.column)}) '
+                       f'DO {"UPDATE SET " + updates if updates else "NOTHING"}')
+        cursor.execute(f'TRUNCATE {stage}')
+
+
+def insert(model, objs, using=DEFAULT_DB_ALIAS, use_copy=True, raw=False, upsert=False):
+    """Write rows with COPY on Postgres, chunked bulk_create elsewhere; upsert updates existing primary keys."""
+    if use_copy and connections[using].vendor == 'postgresql':
+        copy_insert(model, objs, using, raw, upsert)
+        return
+    pk = model._meta.pk
+    update_fields = [field for field in model._meta.local_concrete_fields if field != pk]
+    conflict = {}
+    if upsert:
+        conflict = {'on_conflict': OnConflict.UPDATE, 'unique_fields': [pk], 'update_fields': update_fields} \
+            if update_fields else {'on_conflict': OnConflict.IGNORE}
+    if raw:
+        # bulk_create always runs pre_save; the raw insert path is what loaddata uses
+        for start in range(0, len(objs), BATCH_SIZE):
+            model._base_manager.using(using)._insert(objs[start:start + BATCH_SIZE],
+                                                     fields=model._meta.local_concrete_fields, using=using, raw=True,
+                                                     **conflict)
+    elif upsert:
+        model.objects.using(using).bulk_create(
+            objs, batch_size=BATCH_SIZE, ignore_conflicts=not update_fields, update_conflicts=bool(update_fields),
+            unique_fields=[pk.name] if update_fields else None,
+            update_fields=[field.name for field in update_fields] or None)
+    else:
+        model.objects.using(using).bulk_create(objs, batch_size=BATCH_SIZE)
+
+
+def iter_json_array(file, read_size=1 << 16):
+    """Yield the items of a top-level JSON array one by one without reading the whole file."""
+    decoder = json.JSONDecoder()
+    buffer, position, started = '', 0, False
+    while True:
+        while position < len(buffer) and buffer[position] in ' \t\r\n,':
+            position += 1
+        if not started and position < len(buffer):
+            if buffer[position] != '[':
+                raise ValueError('Expected a JSON array')
+            started, position = True, position + 1
+            continue
+        if position < len(buffer) and buffer[position] == ']':
+            return
+        try:
+            item, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            data = file.read(read_size)
+            if not data:
+                if buffer[position:].strip():
+                    raise
+                return
+            buffer, position = buffer[position:] + data, 0
+            continue
+        if end == len(buffer):
+            # A number may continue in the next read
+            data = file.read(read_size)
+            if data:
+                buffer, position = buffer[position:] + data, 0
+                continue
+        yield item
+        position = end
@@ -0,0 +1,162 @@
+import hashlib
+import threading
+import time
+import uuid
+import weakref
+from functools import wraps
+
+from django.core.cache import cache
+from django.utils.translation import get_language
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+from apps.models import Course, UserCourse
+from apps.serializers import CourseTreeModelSerializer
+
+COURSE_TREE_TIMEOUT = 60 * 60 * 24
+ENROLLMENT_TIMEOUT = 60 * 60
+CATALOG_VERSION_KEY = 'courses:version'
+
+
+def get_version(key):
+    # A random token instead of a counter: an evicted version key can never
+    # come back with a value that matches an old cached entry.
+    return cache.get_or_set(key, uuid.uuid4().hex, None)
+
+
+def bump_version(key):
+    cache.set(key, uuid.uuid4().hex, None)
+
+
+def course_version_key(course_id):
+    return f'course:{course_id}:version'
+
+
+def course_tree_key(course_id, version):
+    return f'course:{course_id}:tree:{version}'
+
+
+def get_course_version(course_id):
+    return get_version(course_version_key(course_id))
+
+
+def bump_course_version(course_id):
+    bump_version(course_version_key(course_id))
+
+
+def invalidate_local(prefix):
+    # Only the two-tier backend keeps per-process copies
+    if hasattr(cache, 'invalidate_prefix'):
+        cache.invalidate_prefix(prefix)
+
+
+def get_course_tree(course_id):
+    key = course_tree_key(course_id, get_course_version(course_id))
+    content = cache.get(key)
+    if content is None:
+        course = Course.objects.with_tree().filter(pk=course_id).first()
+        if course is None:
+            return None
+        content = JSONRenderer().render(CourseTreeModelSerializer(course).data)
+        cache.set(key, content, COURSE_TREE_TIMEOUT)
+    return content
+
+
+def enrollment_key(user_id):
+    return f'user:{user_id}:courses:v1'
+
+
+def get_enrolled_course_ids(user_id):
+    # Course ids are stored packed as 16 raw bytes each
+    key = enrollment_key(user_id)
+    packed = cache.get(key)
+    if packed is None:
+        course_ids = UserCourse.objects.filter(user_id=user_id).values_list('course_id', flat=True)
+        packed = b''.join(course_id.bytes for course_id in course_ids)
+        cache.set(key, packed, ENROLLMENT_TIMEOUT)
+    return {uuid.UUID(bytes=packed[i:i + 16]) for i in range(0, len(packed), 16)}
+
+
+def invalidate_enrollments(*user_ids):
+    cache.delete_many([enrollment_key(user_id) for user_id in user_ids])
+
+
+_local_locks = weakref.WeakValueDictionary()
+_local_locks_guard = threading.Lock()
+
+
+def _local_lock(key):
+    with _local_locks_guard:
+        lock = _local_locks.get(key)
+        if lock is None:
+            lock = _local_locks[key] = threading.Lock()
+        return lock
+
+
+def single_flight(key, compute, timeout=60, stale_timeout=300, wait=5.0, lock_timeout=30):
+    """
+    Return the cached value of key, calling compute() in at most one request at a time.
+
+    Entries stay fresh for timeout seconds and are then served stale for up to
+    stale_timeout more while one caller recomputes them. Threads of a process queue on
+    a local lock, processes on a Redis lock (cache.add); callers with nothing stale to
+    serve wait up to `wait` seconds for the winner before computing themselves.
+    """
+    cache_key, lock_key = f'sf:{key}', f'sf:{key}:lock'
+    entry = cache.get(cache_key)
+    if entry is not None and entry[0] > time.time():
+        return entry[1]
+
+    local_lock = _local_lock(cache_key)
+    if not (local_lock.acquire(blocking=False) if entry is not None else local_lock.acquire(timeout=wait)):
+        return entry[1] if entry is not None else compute()
+    try:
+        latest = cache.get(cache_key)
+        if latest is not None and latest[0] > time.time():
+            return latest[1]
+        entry = latest or entry
+
+        if not cache.add(lock_key, 1, lock_timeout):
+            if entry is not None:
+                return entry[1]
+            deadline = time.monotonic() + wait
+            while time.monotonic() < deadline:
+                time.sleep(0.05)
+                if (latest := cache.get(cache_key)) is not None:
+                    return latest[1]
+            return compute()
+        try:
+            value = compute()
+            cache.set(cache_key, (time.time() + timeout, value), timeout + stale_timeout)
+        finally:
+            cache.delete(lock_key)
+        return value
+    finally:
+        local_lock.release()
+
+
+def coalesce(timeout=60, stale_timeout=300, version=None):
+    """
+    Decorate a DRF view method so concurrent identical requests share one computation.
+
+    The key is the absolute URL plus the active language and version(view), if given.
+    Only the response data and status are cached, so use it on views whose output does
+    not depend on the requesting user.
+    """
+
+    def decorator(method):
+        @wraps(method)
+        def wrapper(view, request, *args, **kwargs):
+            parts = (request.build_absolute_uri(), get_language(), version(view) if version else None)
+            key = f'view:{view.__class__.__name__}.{method.__name__}:{hashlib.md5(repr(parts).encode()).hexdigest()}'
+
+            def compute():
+                response = method(view, request, *args, **kwargs)
+                return response.data, response.status_code
+
+            data, status = single_flight(key, compute, timeout, stale_timeout)
+            return Response(data, status=status)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,258 @@
+import json
+import logging
+import os
+import pickle
+import re
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict, defaultdict
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django_redis.cache import RedisCache
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+# Short-lived coordination keys: single_flight locks and replica pins. They are never read
+# from L1, so writing them needs no broadcast to every process
+L1_EXCLUDE = (r':lock$', r':primary$')
+
+
+class LocalLRU:
+    """Bounded in-process store with a per-entry deadline; values are kept pickled like LocMemCache does."""
+
+    def __init__(self, max_entries, timeout):
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return _MISSING, False
+            expires_at, pickled = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return _MISSING, False
+            self._data.move_to_end(key)
+        return pickle.loads(pickled), True
+
+    def set(self, key, value, timeout):
+        ttl = self.timeout if timeout is None else min(timeout, self.timeout)
+        if ttl <= 0:
+            self.delete(key)
+            return 0
+        pickled = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        evicted = 0
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, pickled)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                evicted += 1
+        return evicted
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def delete_prefix(self, prefix):
+        with self._lock:
+            for key in [key for key in self._data if key.startswith(prefix)]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class TwoTierCache(RedisCache):
+    """
+    django-redis cache with a small in-process LRU (L1) in front of Redis (L2).
+
+    Every write publishes the touched keys on a Redis channel; each process runs a
+    subscriber thread that drops those keys from its own L1. While the subscriber is
+    not connected L1 is bypassed, so a process never serves entries it can't invalidate.
+    Keys matching L1_EXCLUDE live in Redis only.
+    """
+
+    def __init__(self, server, params):
+        options = dict(params.get('OPTIONS', {}))
+        self._l1 = LocalLRU(options.pop('L1_MAX_ENTRIES', 10000), options.pop('L1_TIMEOUT', 60))
+        self._channel = options.pop('INVALIDATION_CHANNEL', 'cache:invalidate')
+        self._l1_exclude = re.compile('|'.join(options.pop('L1_EXCLUDE', L1_EXCLUDE)))
+        # Moves on every invalidation; an L2 read that overlapped one must not fill L1
+        self._generation = 0
+        super().__init__(server, dict(params, OPTIONS=options))
+        self._origin = uuid.uuid4().hex
+        self._stats = defaultdict(Counter)
+        self._stats_lock = threading.Lock()
+        self._subscriber_pid = None
+        self._subscribed = threading.Event()
+
+    # Stats
+
+    def _count(self, key, event, amount=1):
+        if not amount:
+            return
+        namespace = str(key).split(':', 1)[0]
+        with self._stats_lock:
+            self._stats[namespace][event] += amount
+
+    def stats(self):
+        """Return {namespace: {'l1_hits', 'l2_hits', 'misses', 'evictions'}} for this process."""
+        with self._stats_lock:
+            return {namespace: dict(counter) for namespace, counter in self._stats.items()}
+
+    # Invalidation bus
+
+    def _ensure_subscriber(self):
+        # Started lazily so that each forked worker runs its own thread
+        if self._subscriber_pid != os.getpid():
+            self._subscriber_pid = os.getpid()
+            self._subscribed.clear()
+            self._l1.clear()
+            threading.Thread(target=self._listen, name='cache-invalidation', daemon=True).start()
+        return self._subscribed.is_set()
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = self.client.get_client(write=False).pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self._channel)
+                self._generation += 1
+                self._l1.clear()
+                self._subscribed.set()
+                for message in pubsub.listen():
+                    self._on_message(json.loads(message['data']))
+            except Exception:
+                logger.exception('Cache invalidation subscriber disconnected')
+            self._subscribed.clear()
+            self._l1.clear()
+            time.sleep(1)
+
+    def _on_message(self, message):
+        if message['origin'] == self._origin:
+            return
+        self._generation += 1
+        if message.get('clear'):
+            self._l1.clear()
+        self._l1.delete(*message.get('keys', ()))
+        for prefix in message.get('prefixes', ()):
+            self._l1.delete_prefix(prefix)
+
+    def _publish(self, keys=(), prefixes=(), clear=False):
+        message = {'origin': self._origin, 'keys': list(keys), 'prefixes': list(prefixes), 'clear': clear}
+        try:
+            self.client.get_client(write=True).publish(self._channel, json.dumps(message))
+        except Exception:
+            logger.exception('Could not publish cache invalidation')
+
+    def _local_key(self, key, version=None):
+        return str(self.client.make_key(key, version=version))
+
+    def _in_l1(self, key):
+        return not self._l1_exclude.search(str(key))
+
+    def invalidate_prefix(self, prefix, version=None):
+        """Drop L1 entries whose key starts with prefix in every process; Redis is left as is."""
+        local_prefix = self._local_key(prefix, version)
+        self._generation += 1
+        self._l1.delete_prefix(local_prefix)
+        self._publish(prefixes=[local_prefix])
+
+    # Cache API
+
+    def get(self, key, default=None, version=None, client=None):
+        local_key = self._local_key(key, version)
+        use_l1 = self._in_l1(key) and self._ensure_subscriber()
+        if use_l1:
+            value, found = self._l1.get(local_key)
+            if found:
+                self._count(key, 'l1_hits')
+                return value
+        generation = self._generation
+        value = super().get(key, _MISSING, version, client)
+        if value is _MISSING:
+            self._count(key, 'misses')
+            return default
+        self._count(key, 'l2_hits')
+        # An invalidation that arrived during the read may be about this very value
+        if use_l1 and generation == self._generation:
+            self._count(key, 'evictions', self._l1.set(local_key, value, None))
+        return value
+
+    def get_many(self, keys, version=None, client=None):
+        return {key: value for key in keys if (value := self.get(key, _MISSING, version, client)) is not _MISSING}
+
+    def _written(self, key, value, timeout, version):
+        if not self._in_l1(key):
+            return
+        self._generation += 1
+        local_key = self._local_key(key, version)
+        if self._ensure_subscriber():
+            timeout = self.default_timeout if timeout is DEFAULT_TIMEOUT else timeout
+            self._count(key, 'evictions', self._l1.set(local_key, value, timeout))
+        self._publish(keys=[local_key])
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None, client=None, nx=False, xx=False):
+        result = super().set(key, value, timeout=timeout, version=version, client=client, nx=nx, xx=xx)
+        if result:
+            self._written(key, value, timeout, version)
+        return result
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None, client=None):
+        result = super().add(key, value, timeout=timeout, version=version, client=client)
+        if result:
+            self._written(key, value, timeout, version)
+        return result
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None, client=None):
+        result = super().set_many(data, timeout=timeout, version=version, client=client)
+        self._forget(*data, version=version)
+        return result
+
+    def _forget(self, *keys, version=None):
+        local_keys = [self._local_key(key, version) for key in keys if self._in_l1(key)]
+        if not local_keys:
+            return
+        self._generation += 1
+        self._l1.delete(*local_keys)
+        self._publish(keys=local_keys)
+
+    def delete(self, key, version=None, prefix=None, client=None):
+        result = super().delete(key, version=version, prefix=prefix, client=client)
+        self._forget(key, version=version)
+        return result
+
+    def delete_many(self, keys, version=None, client=None):
+        keys = list(keys)
+        result = super().delete_many(keys, version=version, client=client)
+        self._forget(*keys, version=version)
+        return result
+
+    def incr(self, key, delta=1, version=None, client=None, ignore_key_check=False):
+        result = super().incr(key, delta=delta, version=version, client=client, ignore_key_check=ignore_key_check)
+        self._forget(key, version=version)
+        return result
+
+    def decr(self, key, delta=1, version=None, client=None):
+        result = super().decr(key, delta=delta, version=version, client=client)
+        self._forget(key, version=version)
+        return result
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None, client=None):
+        result = super().touch(key, timeout=timeout, version=version, client=client)
+        self._forget(key, version=version)
+        return result
+
+    def clear(self):
+        result = super().clear()
+        self._generation += 1
+        self._l1.clear()
+        self._publish(clear=True)
+        return result
@@ -0,0 +1,92 @@
+import hashlib
+from urllib.parse import parse_qs
+
+from channels.db import database_sync_to_async
+from channels.middleware import BaseMiddleware
+from django.contrib.auth.models import AnonymousUser
+from durin.models import AuthToken
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from apps import metrics
+from apps.cache import single_flight
+from apps.chat.members import STALE_TIMEOUT
+from apps.models import User
+
+# Short enough that deactivated users and revoked durin tokens lock people out within
+# a minute or two, long enough to absorb a reconnect storm
+USER_TIMEOUT = 60
+TOKEN_TIMEOUT = 60
+DURIN_KEYWORD = 'Token'
+
+
+def credentials(scope):
+    """Return (kind, token) from the Authorization header or the ?token= query parameter."""
+    for name, value in scope.get('headers', ()):
+        if name == b'authorization':
+            parts = value.decode('latin-1').split()
+            if len(parts) == 2 and parts[0] in jwt_settings.AUTH_HEADER_TYPES:
+                return 'jwt', parts[1]
+            if len(parts) == 2 and parts[0] == DURIN_KEYWORD:
+                return 'durin', parts[1]
+            return None, None
+    token = parse_qs(scope.get('query_string', b'').decode('latin-1')).get('token', [None])[0]
+    if not token:
+        return None, None
+    # Browsers can't set headers on websockets; a JWT is told apart by its dots
+    return ('jwt' if token.count('.') == 2 else 'durin'), token
+
+
+def jwt_user_id(token):
+    try:
+        return str(AccessToken(token)[jwt_settings.USER_ID_CLAIM])
+    except (TokenError, KeyError):
+        return None
+
+
+def durin_user_id(token):
+    def lookup():
+        auth_token = AuthToken.objects.filter(token=token).only('user_id', 'expiry').first()
+        if auth_token is None or auth_token.has_expired:
+            return ''
+        return str(auth_token.user_id)
+
+    # Keyed by a digest so tokens never show up in cache keys; invalid ones are cached too
+    key = f'ws:durin:{hashlib.sha256(token.encode()).hexdigest()}'
+    return single_flight(key, lookup, TOKEN_TIMEOUT, STALE_TIMEOUT) or None
+
+
+def get_user(user_id):
+    def lookup():
+        return User.objects.filter(pk=user_id, is_active=True).only(
+            'id', 'type', 'is_staff', 'is_superuser', 'is_active').first()
+
+    return single_flight(f'ws:user:{user_id}', lookup, USER_TIMEOUT, STALE_TIMEOUT)
+
+
+def resolve_user(kind, token):
+    user_id = jwt_user_id(token) if kind == 'jwt' else durin_user_id(token)
+    user = get_user(user_id) if user_id else None
+    metrics.WS_AUTH.labels('ok' if user else 'invalid').inc()
+    return user or AnonymousUser()
+
+
+class TokenAuthMiddleware(BaseMiddleware):
+    """
+    Put the user of a simplejwt or durin token into scope['user'].
+
+    JWTs are verified without the database; durin tokens, users and room memberships
+    are cached briefly and looked up by one caller at a time, so a reconnect storm
+    after a deploy costs a handful of queries instead of one per connection.
+    """
+
+    async def __call__(self, scope, receive, send):
+        kind, token = credentials(scope)
+        if kind is None:
+            metrics.WS_AUTH.labels('anonymous').inc()
+            user = AnonymousUser()
+        else:
+            # Off the shared sync thread: lookups of different users shouldn't queue behind each other
+            user = await database_sync_to_async(resolve_user, thread_sensitive=False)(kind, token)
+        return await super().__call__(dict(scope, user=user), receive, send)
@@ -0,0 +1,165 @@
+import asyncio
+import logging
+from collections import defaultdict
+
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.db import IntegrityError, transaction
+
+from apps import unread
+from apps.models import TaskChat
+
+logger = logging.getLogger(__name__)
+
+FLUSH_SIZE = 200
+FLUSH_INTERVAL = 0.25
+# Retries keep messages in memory; past this many the oldest are dropped and logged
+MAX_PENDING = 50000
+# Seconds a stopping worker keeps trying to store what is still pending
+DRAIN_TIMEOUT = 10
+
+
+class WriteBehindBuffer:
+    """
+    Collect chat messages of this process and store them with one bulk_create every
+    flush_size messages or flush_interval seconds. Ids are assigned before the write, so
+    a retried batch (or a message resent by the client) is inserted at most once; the
+    sender gets a chat.ack with the ids once they are stored. Messages still pending when
+    the worker stops are lost unless the drain on lifespan shutdown stores them, so clients
+    resend until they see the ack.
+    """
+
+    def __init__(self, flush_size=FLUSH_SIZE, flush_interval=FLUSH_INTERVAL, max_pending=MAX_PENDING):
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.pending = []
+        # Stored messages whose unread counts are not recorded yet; retried on their own,
+        # since a retried insert would skip them as already stored
+        self.uncounted = []
+        self.full = asyncio.Event()
+        self.task = None
+
+    def add(self, message, reply_channel):
+        self.pending.append((message, reply_channel))
+        if len(self.pending) > self.max_pending:
+            dropped = len(self.pending) - self.max_pending
+            del self.pending[:dropped]
+            logger.error('Chat write-behind buffer is full, dropped %s messages', dropped)
+        if len(self.pending) >= self.flush_size:
+            self.full.set()
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run())
+
+    async def run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.full.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.full.clear()
+            if self.pending:
+                await self.flush()
+            elif self.uncounted:
+                await self.count_unread()
+
+    async def flush(self):
+        batch, self.pending = self.pending[:self.flush_size], self.pending[self.flush_size:]
+        if self.pending:
+            self.full.set()
+        try:
+            rejected, stored = await database_sync_to_async(store)([message for message, _ in batch])
+        except Exception:
+            logger.exception('Storing %s chat messages failed, retrying', len(batch))
+            self.pending[:0] = batch
+            await asyncio.sleep(self.flush_interval)
+            return
+        acks = defaultdict(lambda: {'type': 'chat.ack', 'ids': [], 'rejected': []})
+        for message, reply_channel in batch:
+            acks[reply_channel]['rejected' if message.pk in rejected else 'ids'].append(str(message.pk))
+        channel_layer = get_channel_layer()
+        for reply_channel, ack in acks.items():
+            await channel_layer.send(reply_channel, ack)
+        self.uncounted.extend(stored)
+        await self.count_unread()
+
+    async def count_unread(self):
+        batch, self.uncounted = self.uncounted, []
+        try:
+            await database_sync_to_async(unread.record)(batch)
+        except Exception:
+            logger.exception('Recording unread counts of %s chat messages failed, retrying', len(batch))
+            self.uncounted[:0] = batch
+            if len(self.uncounted) > self.max_pending:
+                dropped = len(self.uncounted) - self.max_pending
+                del self.uncounted[:dropped]
+                logger.error('Dropped the unread counts of %s chat messages', dropped)
+
+    async def close(self, timeout=DRAIN_TIMEOUT):
+        if self.task is not None:
+            self.task.cancel()
+        deadline = asyncio.get_running_loop().time() + timeout
+        while self.pending and asyncio.get_running_loop().time() < deadline:
+            await self.flush()
+        if self.uncounted:
+            await self.count_unread()
+        if self.pending:
+            logger.error('Worker stopped with %s chat messages not stored', len(self.pending))
+        if self.uncounted:
+            logger.error('Worker stopped with the unread counts of %s chat messages not recorded', len(self.uncounted))
+
+
+def insert(messages):
+    """Insert messages, splitting the batch around rows that violate a constraint; return those rows."""
+    if not messages:
+        return []
+    try:
+        # Foreign keys are checked at commit, so the atomic block is what raises
+        with transaction.atomic():
+            TaskChat.objects.bulk_create(messages, ignore_conflicts=True)
+        return []
+    except IntegrityError:
+        if len(messages) == 1:
+            return messages
+        middle = len(messages) // 2
+        return insert(messages[:middle]) + insert(messages[middle:])
+
+
+def store(messages):
+    """
+    Store messages; return the ids of those that can never be stored (deleted task or user)
+    and the messages this call inserted, which are the ones to count as unread.
+    """
+    # Resent messages are already stored and counted
+    stored = set(TaskChat.objects.filter(pk__in=[message.pk for message in messages]).values_list('pk', flat=True))
+    messages = [message for message in messages if message.pk not in stored]
+    rejected = {message.pk for message in insert(messages)}
+    if rejected:
+        logger.warning('Dropped %s chat messages of deleted tasks or users: %s', len(rejected),
+                       ', '.join(map(str, rejected)))
+    return rejected, [message for message in messages if message.pk not in rejected]
+
+
+_buffers = {}
+
+
+def get_buffer():
+    # One buffer per event loop; asyncio primitives can't cross loops
+    loop = asyncio.get_running_loop()
+    if loop not in _buffers:
+        _buffers[loop] = WriteBehindBuffer()
+    return _buffers[loop]
+
+
+async def lifespan(scope, receive, send):
+    """ASGI lifespan app that stores the pending chat messages of a stopping worker."""
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            buffer = _buffers.pop(asyncio.get_running_loop(), None)
+            if buffer is not None:
+                await buffer.close()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
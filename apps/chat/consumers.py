@@ -1,27 +1,103 @@
 import json
+import uuid
 
+import msgpack
+from channels.db import database_sync_to_async
 from channels.generic.websocket import AsyncJsonWebsocketConsumer
 
+from apps.chat.buffer import get_buffer
+from apps.chat.members import can_join
+from apps.models import TaskChat, uuid7
+
+TEXT_LENGTH = TaskChat._meta.get_field('text').max_length
+# Clients asking for this subprotocol send and receive binary msgpack frames instead of JSON text
+MSGPACK = "msgpack"
+
+
+def encode_json(content):
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":"))
+
+
+def encode(content):
+    """Both frame formats of one payload, so a fan-out encodes once instead of once per recipient."""
+    return {"text": encode_json(content), "bytes": msgpack.packb(content)}
+
+
+def parse_uuid(value):
+    try:
+        return uuid.UUID(str(value))
+    except ValueError:
+        return None
+
 
 class ChatConsumer(AsyncJsonWebsocketConsumer):
     async def connect(self):
         self.room_name = self.scope["url_route"]["kwargs"]["room_name"]
         self.room_group_name = f"chat_{self.room_name}"
+        # Rooms named after a task (its id in hex) keep their history in TaskChat
+        self.task_id = parse_uuid(self.room_name)
+
+        user = self.scope["user"]
+        if not user.is_authenticated:
+            await self.close(code=4001)
+            return
+        if not await database_sync_to_async(can_join, thread_sensitive=False)(user, self.task_id):
+            await self.close(code=4003)
+            return
+
+        self.binary = MSGPACK in self.scope.get("subprotocols", ())
 
         await self.channel_layer.group_add(self.room_group_name, self.channel_name)
 
-        await self.accept()
+        await self.accept(subprotocol=MSGPACK if self.binary else None)
 
     async def disconnect(self, close_code):
+        if not hasattr(self, "binary"):
+            # Rejected before joining
+            return
         # Leave room group
         await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
 
+    async def receive(self, text_data=None, bytes_data=None, **kwargs):
+        if bytes_data is not None and self.binary:
+            try:
+                content = msgpack.unpackb(bytes_data)
+            except ValueError:
+                await self.send_payload(encode({"error": "invalid msgpack frame"}))
+                return
+            await self.receive_json(content, **kwargs)
+        else:
+            await super().receive(text_data, bytes_data, **kwargs)
+
+    async def send_payload(self, payload):
+        if self.binary:
+            await self.send(bytes_data=payload["bytes"])
+        else:
+            await self.send(text_data=payload["text"])
+
     async def receive_json(self, content, **kwargs):
+        if not isinstance(content, dict) or "message" not in content:
+            await self.send_payload(encode({"error": "message is required"}))
+            return
         message = content["message"]
-        await self.channel_layer.group_send(self.room_group_name, {"type": "chat.message", "message": message})
+        user = self.scope["user"]
+        payload = {"message": message}
+        if self.task_id:
+            if not isinstance(message, str) or not 0 < len(message) <= TEXT_LENGTH:
+                await self.send_payload(encode({"error": f"message must be 1 to {TEXT_LENGTH} characters"}))
+                return
+            # A client-chosen id makes resending after a lost ack safe
+            message_id = parse_uuid(content.get("id")) or uuid7()
+            get_buffer().add(TaskChat(id=message_id, user_id=user.pk, task_id=self.task_id, text=message,
+                                      file='', voice=''), self.channel_name)
+            payload.update(id=str(message_id), user=str(user.pk))
+        await self.channel_layer.group_send(self.room_group_name, {"type": "chat.message", **encode(payload)})
 
     async def chat_message(self, event):
-        message = event["message"]
+        # Already encoded by the sender
+        await self.send_payload(event)
 
-        # Send message to WebSocket
-        await self.send(text_data=json.dumps({"message": message}))
+    async def chat_ack(self, event):
+        # Stored in TaskChat; the client can stop resending these
+        # Rejected ones belong to a deleted task or user and will never be stored
+        await self.send_payload(encode({"ack": event["ids"], "rejected": event["rejected"]}))
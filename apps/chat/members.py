@@ -0,0 +1,49 @@
+from collections import defaultdict
+
+from django.db.models import Q
+
+from apps.cache import get_enrolled_course_ids, single_flight
+from apps.models import Task, User, UserCourse
+
+MEMBERSHIP_TIMEOUT = 60
+TASK_COURSE_TIMEOUT = 60 * 60
+STALE_TIMEOUT = 30
+
+
+def mentors():
+    """Users who may be in every room: staff, teachers, assistants and admins."""
+    return Q(is_staff=True) | ~Q(type=User.UserType.STUDENT)
+
+
+def is_mentor(user):
+    return user.is_staff or user.type != User.UserType.STUDENT
+
+
+def task_course_id(task_id):
+    # A task never moves to another course in practice, so this may live long
+    return single_flight(f'ws:task:{task_id}:course', lambda: Task.objects.filter(pk=task_id).values_list(
+        'lesson__module__course_id', flat=True).first(), TASK_COURSE_TIMEOUT, STALE_TIMEOUT)
+
+
+def can_join(user, task_id):
+    """Mentors may join every room; students only rooms of tasks in courses they are enrolled in."""
+    if is_mentor(user):
+        return True
+    if task_id is None:
+        return False
+
+    def check():
+        course_id = task_course_id(task_id)
+        return course_id is not None and course_id in get_enrolled_course_ids(user.pk)
+
+    return single_flight(f'ws:member:{user.pk}:{task_id}', check, MEMBERSHIP_TIMEOUT, STALE_TIMEOUT)
+
+
+def room_members(task_ids):
+    """Return {task id: {user ids}} of everyone can_join lets into the rooms of these tasks."""
+    mentor_ids = set(User.objects.filter(mentors(), is_active=True).values_list('id', flat=True))
+    members = defaultdict(lambda: set(mentor_ids))
+    for task_id, user_id in UserCourse.objects.filter(course__module__lesson__task__in=task_ids).values_list(
+            'course__module__lesson__task', 'user_id'):
+        members[task_id].add(user_id)
+    return members
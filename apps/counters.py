@@ -0,0 +1,119 @@
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest, Now
+
+from apps.cache import CATALOG_VERSION_KEY, bump_course_version, bump_version
+from apps.models import Course, Lesson, Module, Task, Video
+
+# (model, counter field, counted model, lookup from counted model to model)
+COUNTERS = (
+    (Course, 'modul_count', Module, 'course'),
+    (Course, 'lesson_count', Lesson, 'module__course'),
+    (Course, 'task_count', Task, 'lesson__module__course'),
+    (Module, 'lesson_count', Lesson, 'module'),
+    (Module, 'task_count', Task, 'lesson__module'),
+    (Lesson, 'video_count', Video, 'lesson'),
+)
+
+# model -> lookup from the model to its course id
+COURSE_LOOKUPS = {Course: 'pk', Module: 'course_id', Lesson: 'module__course_id'}
+
+_state = threading.local()
+
+
+def _changed_courses(model, pks, using=DEFAULT_DB_ALIAS):
+    """After commit, drop cached course trees and, for course counters, the catalog."""
+    if model is Course:
+        course_ids = set(pks)
+    else:
+        course_ids = set(model.objects.using(using).filter(pk__in=pks).values_list(COURSE_LOOKUPS[model],
+                                                                                     flat=True))
+
+    def bump():
+        for course_id in course_ids:
+            bump_course_version(course_id)
+        if model is Course:
+            bump_version(CATALOG_VERSION_KEY)
+
+    transaction.on_commit(bump, using=using)
+
+
+def _apply(model, pk, deltas):
+    values = {field: Greatest(F(field) + delta, Value(0)) for field, delta in deltas.items() if delta}
+    if values:
+        # update() skips auto_now; the ETags of course lists are built from update_at
+        model.objects.filter(pk=pk).update(**values, update_at=Now())
+        # Module and lesson counters only move with a save that already drops the course tree
+        if model is Course:
+            _changed_courses(Course, [pk])
+
+
+def increment(model, pk, field, delta=1):
+    if pk is None:
+        return
+    pending = getattr(_state, 'pending', None)
+    if pending is None:
+        _apply(model, pk, {field: delta})
+    else:
+        pending[(model, pk)][field] += delta
+
+
+@contextmanager
+def deferred(using=None):
+    """Collect counter changes and write them as one UPDATE per parent row on exit."""
+    if getattr(_state, 'pending', None) is not None:
+        yield
+        return
+    _state.pending = defaultdict(lambda: defaultdict(int))
+    _state.parents = {}
+    try:
+        with transaction.atomic(using=using):
+            yield
+            for (model, pk), deltas in _state.pending.items():
+                _apply(model, pk, deltas)
+    finally:
+        _state.pending = None
+        _state.parents = None
+
+
+def _cached_parents(key, lookup):
+    parents = getattr(_state, 'parents', None)
+    if parents is None:
+        return lookup()
+    if key not in parents:
+        parents[key] = lookup()
+    return parents[key]
+
+
+def module_course_id(module_id):
+    return _cached_parents(('module', module_id), lambda: Module.objects.filter(
+        pk=module_id).values_list('course_id', flat=True).first())
+
+
+def lesson_parent_ids(lesson_id):
+    return _cached_parents(('lesson', lesson_id), lambda: Lesson.objects.filter(
+        pk=lesson_id).values_list('module_id', 'module__course_id').first() or (None, None))
+
+
+def _actual_count(model, lookup):
+    counted = model.objects.filter(**{lookup: OuterRef('pk')}).order_by().values(lookup).annotate(
+        total=Count('pk')).values('total')
+    return Coalesce(Subquery(counted), Value(0))
+
+
+def reconcile(using=DEFAULT_DB_ALIAS):
+    fixed = {}
+    for model, field, counted, lookup in COUNTERS:
+        actual = _actual_count(counted, lookup)
+        rows = model.objects.using(using)
+        with transaction.atomic(using=using):
+            pks = list(rows.exclude(**{field: actual}).values_list('pk', flat=True))
+            fixed[f'{model._meta.model_name}.{field}'] = rows.filter(pk__in=pks).update(
+                **{field: actual}, update_at=Now())
+            if pks:
+                _changed_courses(model, pks, using)
+    return fixed
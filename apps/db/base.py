@@ -0,0 +1,54 @@
+import os
+import threading
+
+from django.db.backends.postgresql import base
+from psycopg2.extensions import ISOLATION_LEVEL_READ_COMMITTED
+
+from apps.db.pool import ConnectionPool, PoolTimeout
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """
+    PostgreSQL backend that takes connections from a per-process pool configured by
+    OPTIONS['pool'] and gives them back on close(), so CONN_MAX_AGE should stay 0.
+    Without OPTIONS['pool'] it behaves like the stock backend.
+    """
+
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        params.pop('pool', None)
+        return params
+
+    @property
+    def pool(self):
+        options = self.settings_dict['OPTIONS'].get('pool')
+        if not options:
+            return None
+        # Keyed by pid: a forked Celery or gunicorn child must not reuse its parent's sockets.
+        # The target is part of the key because test setup renames NAME on a live wrapper.
+        key = (self.alias, os.getpid(), *(self.settings_dict[name] for name in ('HOST', 'PORT', 'NAME', 'USER')))
+        if key not in _pools:
+            with _pools_lock:
+                if key not in _pools:
+                    _pools[key] = ConnectionPool(self.alias, **options)
+        return _pools[key]
+
+    def get_new_connection(self, conn_params):
+        pool = self.pool
+        if pool is None:
+            return super().get_new_connection(conn_params)
+        self.isolation_level = self.settings_dict['OPTIONS'].get('isolation_level', ISOLATION_LEVEL_READ_COMMITTED)
+        try:
+            return pool.getconn(lambda: super(DatabaseWrapper, self).get_new_connection(conn_params))
+        except PoolTimeout as e:
+            raise self.Database.OperationalError(str(e)) from e
+
+    def _close(self):
+        pool = self.pool
+        if pool is None or self.connection is None:
+            return super()._close()
+        with self.wrap_database_errors:
+            pool.putconn(self.connection)
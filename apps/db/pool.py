@@ -0,0 +1,115 @@
+import threading
+import time
+from collections import deque
+
+from apps import metrics
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    """
+    A per-process pool of open DB-API connections. Up to max_size connections are
+    handed out at once; callers wait up to `timeout` seconds for a free one.
+    Connections idle for longer than check_interval are pinged before reuse, and
+    idle connections above min_size are closed after max_idle seconds.
+    """
+
+    def __init__(self, alias, min_size=1, max_size=4, timeout=10.0, max_idle=300.0, check_interval=30.0):
+        self.alias = alias
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.check_interval = check_interval
+        self.idle = deque()
+        self.in_use = 0
+        self.lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(max_size)
+        metrics.DB_POOL_MAX_SIZE.labels(alias).set(max_size)
+
+    def getconn(self, connect):
+        started = time.perf_counter()
+        if not self.slots.acquire(timeout=self.timeout):
+            metrics.DB_POOL_TIMEOUTS.labels(self.alias).inc()
+            raise PoolTimeout(f'No free connection in the {self.alias!r} pool after {self.timeout}s')
+        metrics.DB_POOL_WAIT.labels(self.alias).observe(time.perf_counter() - started)
+        try:
+            connection = self._take_idle() or connect()
+        except BaseException:
+            self.slots.release()
+            raise
+        with self.lock:
+            self.in_use += 1
+        self._export()
+        return connection
+
+    def putconn(self, connection):
+        try:
+            if self._reset(connection):
+                with self.lock:
+                    self.idle.append((connection, time.monotonic()))
+            else:
+                self._discard(connection)
+        finally:
+            with self.lock:
+                self.in_use -= 1
+            self.slots.release()
+            self._prune()
+            self._export()
+
+    def _take_idle(self):
+        while True:
+            with self.lock:
+                if not self.idle:
+                    return None
+                connection, last_used = self.idle.pop()
+            if time.monotonic() - last_used < self.check_interval or self._healthy(connection):
+                return connection
+            metrics.DB_POOL_HEALTH_FAILURES.labels(self.alias).inc()
+            self._discard(connection)
+
+    def _healthy(self, connection):
+        if connection.closed:
+            return False
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            return True
+        except Exception:
+            return False
+
+    def _reset(self, connection):
+        # Only connections that are open and outside a transaction go back to the pool
+        if connection.closed:
+            return False
+        try:
+            if connection.get_transaction_status() != 0:
+                connection.rollback()
+            connection.autocommit = True
+            return True
+        except Exception:
+            return False
+
+    def _discard(self, connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def _prune(self):
+        expired = []
+        with self.lock:
+            now = time.monotonic()
+            # Oldest connections are at the left; keep min_size of them regardless of age
+            while len(self.idle) + self.in_use > self.min_size and self.idle and \
+                    now - self.idle[0][1] > self.max_idle:
+                expired.append(self.idle.popleft()[0])
+        for connection in expired:
+            self._discard(connection)
+
+    def _export(self):
+        metrics.DB_POOL_CONNECTIONS.labels(self.alias, 'in_use').set(self.in_use)
+        metrics.DB_POOL_CONNECTIONS.labels(self.alias, 'idle').set(len(self.idle))
@@ -0,0 +1,105 @@
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+
+logger = logging.getLogger(__name__)
+
+# True while replica reads are allowed: safe requests of users that are not pinned
+replica_reads = ContextVar('replica_reads', default=False)
+
+LAG_SQL = '''
+SELECT CASE
+    WHEN NOT pg_is_in_recovery() THEN 0
+    WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+END
+'''
+
+_lag = {}
+_lag_lock = threading.Lock()
+
+
+def pin_key(user_id):
+    return f'user:{user_id}:primary'
+
+
+def pin_primary(user_id):
+    """Send this user's reads to the primary for REPLICA_PIN_SECONDS so they see their own writes."""
+    if user_id is not None and settings.DATABASE_REPLICAS:
+        cache.set(pin_key(user_id), 1, settings.REPLICA_PIN_SECONDS)
+
+
+def is_pinned(user_id):
+    return user_id is not None and cache.get(pin_key(user_id)) is not None
+
+
+@contextmanager
+def use_replicas(allowed=True):
+    token = replica_reads.set(allowed)
+    try:
+        yield
+    finally:
+        replica_reads.reset(token)
+
+
+def measure_lag(alias):
+    connection = connections[alias]
+    if connection.vendor != 'postgresql':
+        return 0.0
+    with connection.cursor() as cursor:
+        cursor.execute(LAG_SQL)
+        return float(cursor.fetchone()[0])
+
+
+def replica_lag(alias):
+    """Replication lag in seconds, measured at most every REPLICA_LAG_CHECK_INTERVAL; None if unreachable."""
+    now = time.monotonic()
+    with _lag_lock:
+        lag, measured_at = _lag.get(alias, (None, None))
+        if measured_at is not None and now - measured_at < settings.REPLICA_LAG_CHECK_INTERVAL:
+            return lag
+        # Other threads keep using the old value while this one measures
+        _lag[alias] = (lag, now)
+    try:
+        lag = measure_lag(alias)
+    except Exception:
+        logger.warning('Replica %s is unreachable', alias, exc_info=True)
+        lag = None
+    with _lag_lock:
+        _lag[alias] = (lag, now)
+    return lag
+
+
+def healthy_replicas():
+    return [alias for alias in settings.DATABASE_REPLICAS
+            if (lag := replica_lag(alias)) is not None and lag <= settings.REPLICA_MAX_LAG]
+
+
+class ReplicaRouter:
+    """
+    Writes, migrations and anything inside a transaction use the primary. Reads go to a
+    random replica within REPLICA_MAX_LAG seconds, but only while replica_reads is set.
+    """
+
+    def db_for_read(self, model, **hints):
+        if not replica_reads.get() or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        replicas = healthy_replicas()
+        return random.choice(replicas) if replicas else DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
@@ -0,0 +1,85 @@
+import csv
+import io
+import re
+import time
+from itertools import islice
+
+from django.db import transaction
+
+from apps.cache import invalidate_enrollments
+from apps.models import (Lesson, Module, User, UserCourse, UserCourseProgress,
+                         UserLesson, UserModule, )
+
+CHUNK_SIZE = 500
+BATCH_SIZE = 5000
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def phone_numbers_from_csv(file):
+    """Yield normalized phone numbers from the first column, reading the upload line by line."""
+    for row in csv.reader(io.TextIOWrapper(file, encoding='utf-8-sig')):
+        digits = re.sub(r'\D', '', row[0]) if row else ''
+        if len(digits) >= 9:
+            yield digits[-9:]
+
+
+def user_ids_for_phone_numbers(phone_numbers, chunk_size=CHUNK_SIZE):
+    for chunk in chunked(phone_numbers, chunk_size):
+        yield from User.objects.filter(phone_number__in=chunk).values_list('id', flat=True)
+
+
+def _course_plan(course):
+    modules = list(Module.objects.filter(course=course).order_by('order').values_list('id', flat=True))
+    lessons = list(Lesson.objects.filter(module__course=course).order_by(
+        'module__order', 'order').values_list('id', flat=True))
+    return modules, lessons
+
+
+def enroll(course, user_ids, chunk_size=CHUNK_SIZE):
+    """Create UserCourse/UserModule/UserLesson rows for many users; existing rows are left untouched."""
+    started = time.perf_counter()
+    modules, lessons = _course_plan(course)
+    first_module = modules[0] if modules else None
+    first_lesson = lessons[0] if lessons else None
+    in_prog = UserCourse.StatusChoices.IN_PROG
+    blocked = UserCourse.StatusChoices.BLOCKED
+    users = rows = 0
+
+    for chunk in chunked(user_ids, chunk_size):
+        # Unknown ids would fail the foreign keys at commit; ignore_conflicts only covers unique ones
+        chunk = list(User.objects.filter(id__in=chunk).values_list('id', flat=True))
+        if not chunk:
+            continue
+        with transaction.atomic():
+            UserCourse.objects.bulk_create(
+                [UserCourse(user_id=user_id, course=course, status=in_prog) for user_id in chunk],
+                batch_size=BATCH_SIZE, ignore_conflicts=True)
+            UserCourseProgress.objects.bulk_create(
+                [UserCourseProgress(user_id=user_id, course=course, next_lesson_id=first_lesson) for user_id in chunk],
+                batch_size=BATCH_SIZE, ignore_conflicts=True)
+            UserModule.objects.bulk_create(
+                [UserModule(user_id=user_id, module_id=module_id,
+                            status=in_prog if module_id == first_module else blocked)
+                 for user_id in chunk for module_id in modules],
+                batch_size=BATCH_SIZE, ignore_conflicts=True)
+            UserLesson.objects.bulk_create(
+                [UserLesson(user_id=user_id, lesson_id=lesson_id,
+                            status=in_prog if lesson_id == first_lesson else blocked)
+                 for user_id in chunk for lesson_id in lessons],
+                batch_size=BATCH_SIZE, ignore_conflicts=True)
+        invalidate_enrollments(*chunk)
+        users += len(chunk)
+        rows += len(chunk) * (2 + len(modules) + len(lessons))
+
+    seconds = time.perf_counter() - started
+    return {
+        'users': users,
+        'rows': rows,
+        'seconds': round(seconds, 3),
+        'rows_per_second': round(rows / seconds) if seconds else rows,
+    }
@@ -0,0 +1,237 @@
+import json
+import platform
+import random
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from prometheus_client.parser import text_string_to_metric_families
+
+from apps.models import User, UserCourse, UserLesson
+from apps.seed import PASSWORD
+
+# name -> (view, method, path, data, weight); path and data take the worker's student context
+MIX = {
+    'lesson': ('LessonRetrieveAPIView', 'get', lambda s, rng: f'lesson/{rng.choice(s["lessons"])}/', None, 30),
+    'my-courses': ('UserCourseListAPIView', 'get', lambda s, rng: 'user/my-courses/', None, 20),
+    'user-task': ('UserTaskRetrieveAPIView', 'get', lambda s, rng: f'user/task/{rng.choice(s["lessons"])}', None, 20),
+    'user-module': ('UserModuleListAPIView', 'get', lambda s, rng: 'user/module/', None, 8),
+    'course-tree': ('CourseTreeAPIView', 'get', lambda s, rng: f'course/{rng.choice(s["courses"])}/tree/', None, 8),
+    'course-list': ('CourseAllListAPIView', 'get', lambda s, rng: 'course/', None, 6),
+    'get-me': ('MyUserModelAPIView', 'get', lambda s, rng: 'user/get-me', None, 5),
+    'token': ('CustomTokenObtainPairView', 'post', lambda s, rng: 'token/',
+              lambda s: {'phone_number': s['phone_number'], 'password': s['password']}, 3),
+}
+# --async swaps these for their apps.async_views twins; view names are the URL names
+ASYNC_MIX = {
+    'lesson': ('async_lesson', 'get', lambda s, rng: f'async/lesson/{rng.choice(s["lessons"])}/', None, 30),
+    'user-task': ('async_user_task', 'get', lambda s, rng: f'async/user/task/{rng.choice(s["lessons"])}', None, 20),
+    'course-list': ('async_course_list', 'get', lambda s, rng: 'async/course/', None, 6),
+    'get-me': ('async_user_get_me', 'get', lambda s, rng: 'async/user/get-me', None, 5),
+}
+# Endpoints that fail the run when they regress
+TRACKED = ('lesson', 'my-courses', 'user-task', 'token')
+
+
+def percentile(values, fraction):
+    # Nearest rank on sorted values
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def sql_queries(text):
+    """Return {view: (sum, count)} of the http_request_sql_queries histogram in a /metrics page."""
+    totals = defaultdict(lambda: [0.0, 0.0])
+    for family in text_string_to_metric_families(text):
+        if family.name != 'http_request_sql_queries':
+            continue
+        for sample in family.samples:
+            if sample.name.endswith('_sum'):
+                totals[sample.labels['view']][0] += sample.value
+            elif sample.name.endswith('_count'):
+                totals[sample.labels['view']][1] += sample.value
+    return totals
+
+
+class Command(BaseCommand):
+    help = 'Replay a weighted mix of API requests against a running server, report latency percentiles and ' \
+           'compare them with a JSON baseline'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://localhost:8000', help='Server to benchmark')
+        parser.add_argument('--prefix', default='/en/api/v1/')
+        parser.add_argument('--concurrency', type=int, default=8, help='Parallel clients, one student each')
+        parser.add_argument('--requests', type=int, default=2000, help='Measured requests in total')
+        parser.add_argument('--warmup', type=int, default=200, help='Unmeasured requests sent first')
+        parser.add_argument('--password', default=PASSWORD, help='Password of the seeded students')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Write the results as JSON to this file')
+        parser.add_argument('--baseline', help='Compare with this JSON baseline and fail on regressions')
+        parser.add_argument('--threshold', type=float, default=0.2,
+                            help='Allowed relative p95/p99 slowdown against the baseline')
+        parser.add_argument('--min-delta', type=float, default=2.0,
+                            help='Ignore slowdowns smaller than this many milliseconds')
+        parser.add_argument('--async', action='store_true', dest='use_async',
+                            help='Use the async views for the endpoints that have one (run under ASGI)')
+        parser.add_argument('--metrics-token', default=getattr(settings, 'METRICS_TOKEN', None))
+
+    def handle(self, *args, **options):
+        self.base = options['url'].rstrip('/') + options['prefix']
+        self.mix = {**MIX, **ASYNC_MIX} if options['use_async'] else MIX
+        students = self.students(options['concurrency'], options['password'])
+        for student in students:
+            student['token'] = self.login(student)
+
+        self.run(students, options['warmup'], options['seed'] - 1)
+        queries_before = self.scrape(options)
+        started = time.perf_counter()
+        samples = self.run(students, options['requests'], options['seed'])
+        seconds = time.perf_counter() - started
+        queries_after = self.scrape(options)
+
+        results = self.summarize(samples, seconds, queries_before, queries_after, options)
+        self.report(results)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(f'Results written to {options["output"]}')
+        if options['baseline']:
+            self.compare(results, options)
+
+    def students(self, count, password):
+        users = User.objects.filter(type=User.UserType.STUDENT, usercourse__isnull=False).distinct() \
+                    .order_by('phone_number').values('id', 'phone_number')[:count]
+        students = []
+        for user in users:
+            courses = list(UserCourse.objects.filter(user_id=user['id']).values_list('course_id', flat=True))
+            lessons = list(UserLesson.objects.filter(user_id=user['id']).order_by('lesson_id')
+                           .values_list('lesson_id', flat=True)[:100])
+            if lessons:
+                students.append({'phone_number': user['phone_number'], 'password': password,
+                                 'courses': courses, 'lessons': lessons})
+        if not students:
+            raise CommandError('No enrolled students found, seed the database first (manage.py seed_scale)')
+        return students
+
+    def login(self, student):
+        response = requests.post(self.base + 'token/', json={'phone_number': student['phone_number'],
+                                                             'password': student['password']})
+        if response.status_code != 200:
+            raise CommandError(f'Login as {student["phone_number"]} failed: HTTP {response.status_code}')
+        return response.json()['access']
+
+    def run(self, students, total, seed):
+        """Send `total` requests from one client thread per student; return [(name, ms, status), ...]."""
+        names = list(self.mix)
+        weights = [self.mix[name][4] for name in names]
+        remaining = iter(range(total))
+        lock = threading.Lock()
+
+        def client(index):
+            student = students[index]
+            rng = random.Random(seed * 1000 + index)
+            session = requests.Session()
+            session.headers['Authorization'] = f'Bearer {student["token"]}'
+            samples = []
+            while True:
+                with lock:
+                    if next(remaining, None) is None:
+                        return samples
+                name = rng.choices(names, weights)[0]
+                _, method, path, data, _ = self.mix[name]
+                started = time.perf_counter()
+                response = session.request(method, self.base + path(student, rng),
+                                           json=data(student) if data else None)
+                samples.append((name, (time.perf_counter() - started) * 1000, response.status_code))
+
+        with ThreadPoolExecutor(len(students)) as pool:
+            return [sample for samples in pool.map(client, range(len(students))) for sample in samples]
+
+    def scrape(self, options):
+        headers = {'Authorization': f'Bearer {options["metrics_token"]}'} if options['metrics_token'] else {}
+        try:
+            response = requests.get(options['url'].rstrip('/') + '/metrics', headers=headers)
+        except requests.RequestException:
+            return None
+        return sql_queries(response.text) if response.status_code == 200 else None
+
+    def summarize(self, samples, seconds, queries_before, queries_after, options):
+        by_name = defaultdict(list)
+        errors = defaultdict(int)
+        for name, ms, status in samples:
+            by_name[name].append(ms)
+            if status >= 400:
+                errors[name] += 1
+
+        endpoints = {}
+        for name, latencies in sorted(by_name.items()):
+            latencies.sort()
+            queries = None
+            if queries_before is not None and queries_after is not None:
+                view = self.mix[name][0]
+                total = queries_after[view][0] - queries_before[view][0]
+                count = queries_after[view][1] - queries_before[view][1]
+                queries = round(total / count, 2) if count else None
+            endpoints[name] = {
+                'view': self.mix[name][0],
+                'requests': len(latencies),
+                'errors': errors[name],
+                'rps': round(len(latencies) / seconds, 1),
+                'mean_ms': round(sum(latencies) / len(latencies), 2),
+                'p50_ms': round(percentile(latencies, 0.50), 2),
+                'p95_ms': round(percentile(latencies, 0.95), 2),
+                'p99_ms': round(percentile(latencies, 0.99), 2),
+                'queries': queries,
+            }
+        return {
+            'created': timezone.now().isoformat(),
+            'url': options['url'],
+            'python': platform.python_version(),
+            'concurrency': options['concurrency'],
+            'async': options['use_async'],
+            'requests': len(samples),
+            'seconds': round(seconds, 2),
+            'rps': round(len(samples) / seconds, 1),
+            'endpoints': endpoints,
+        }
+
+    def report(self, results):
+        self.stdout.write(f'{"endpoint":<14}{"requests":>9}{"errors":>7}{"rps":>8}'
+                          f'{"p50":>9}{"p95":>9}{"p99":>9}{"queries":>9}')
+        for name, stats in results['endpoints'].items():
+            queries = '-' if stats['queries'] is None else stats['queries']
+            line = f'{name:<14}{stats["requests"]:>9}{stats["errors"]:>7}{stats["rps"]:>8}' \
+                   f'{stats["p50_ms"]:>9}{stats["p95_ms"]:>9}{stats["p99_ms"]:>9}{queries:>9}'
+            self.stdout.write(self.style.ERROR(line) if stats['errors'] else line)
+        self.stdout.write(f'{results["requests"]} requests in {results["seconds"]}s, {results["rps"]} req/s '
+                          f'at concurrency {results["concurrency"]}{" (async views)" if results["async"] else ""}')
+
+    def compare(self, results, options):
+        try:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)['endpoints']
+        except FileNotFoundError:
+            raise CommandError(f'Baseline {options["baseline"]} not found, create it with --output')
+
+        failures = []
+        for name in TRACKED:
+            old, new = baseline.get(name), results['endpoints'].get(name)
+            if old is None or new is None:
+                continue
+            problems = []
+            if new['errors']:
+                problems.append(f'{new["errors"]} errors')
+            for key in ('p95_ms', 'p99_ms'):
+                if new[key] > old[key] * (1 + options['threshold']) and new[key] - old[key] >= options['min_delta']:
+                    problems.append(f'{key} {old[key]} -> {new[key]}')
+            if old['queries'] is not None and new['queries'] is not None and new['queries'] > old['queries']:
+                problems.append(f'queries {old["queries"]} -> {new["queries"]}')
+            if problems:
+                failures.append(f'{name} ({", ".join(problems)})')
+        if failures:
+            raise CommandError(f'Regressed against {options["baseline"]}: {"; ".join(failures)}')
+        self.stdout.write(self.style.SUCCESS(f'No regressions against {options["baseline"]}'))
@@ -0,0 +1,61 @@
+import json
+import random
+import string
+import time
+import uuid
+
+import msgpack
+from django.core.management.base import BaseCommand
+
+from apps.chat.consumers import encode, encode_json
+
+# Latin and Cyrillic Uzbek mix; non-ASCII text is where escaped JSON costs bytes
+ALPHABET = string.ascii_letters + ' ' * 10 + 'абвгдеёжзийклмнопрстуфхцчшўқғҳ'
+
+
+def frame_header(length):
+    # Server to client websocket frames are unmasked
+    return 2 if length < 126 else 4 if length < 2 ** 16 else 10
+
+
+def size(frame):
+    return len(frame.encode() if isinstance(frame, str) else frame)
+
+
+class Command(BaseCommand):
+    help = 'Compare per-recipient JSON encoding of a chat fan-out with encoding once (JSON text and msgpack): ' \
+           'CPU and bytes on the wire per message for one room'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--members', type=int, default=500, help='Connections in the room')
+        parser.add_argument('--messages', type=int, default=2000)
+        parser.add_argument('--length', type=int, default=200, help='Characters per message text')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        members = options['members']
+        payloads = [{'message': ''.join(rng.choices(ALPHABET, k=options['length'])),
+                     'id': str(uuid.UUID(int=rng.getrandbits(128))), 'user': str(uuid.UUID(int=rng.getrandbits(128)))}
+                    for _ in range(options['messages'])]
+
+        # name -> (frames for the whole room, frame one member receives, event the channel layer carries)
+        strategies = {
+            'json per member': (lambda payload: [json.dumps(payload) for _ in range(members)][0],
+                                lambda payload: {'type': 'chat.message', **payload}),
+            'json once': (encode_json, None),
+            'msgpack once': (msgpack.packb, None),
+        }
+        self.stdout.write(f'{members} members, {len(payloads)} messages of {options["length"]} characters')
+        self.stdout.write(f'{"encoding":<18}{"cpu us/msg":>12}{"frame B":>10}{"wire KiB/msg":>14}{"layer B":>10}')
+        for name, (encode_room, event) in strategies.items():
+            started = time.process_time()
+            frames = [encode_room(payload) for payload in payloads]
+            cpu = (time.process_time() - started) / len(payloads) * 1e6
+            sizes = [size(frame) for frame in frames]
+            wire = sum(length + frame_header(length) for length in sizes) * members / len(sizes)
+            # Encoded once, the event holds both formats since members may use either
+            events = [event(payload) if event else {'type': 'chat.message', **encode(payload)} for payload in payloads]
+            layer = sum(len(msgpack.packb(item)) for item in events) / len(events)
+            self.stdout.write(f'{name:<18}{cpu:>12.1f}{sum(sizes) / len(sizes):>10.0f}{wire / 1024:>14.1f}'
+                              f'{layer:>10.0f}')
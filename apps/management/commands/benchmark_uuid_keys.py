@@ -0,0 +1,44 @@
+import io
+import time
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from apps.models import uuid7
+
+GENERATORS = {'uuid4': uuid.uuid4, 'uuid7': uuid7}
+
+
+class Command(BaseCommand):
+    help = 'Compare insert throughput and primary key index size of random (v4) and time-ordered (v7) UUID keys'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1_000_000, help='Rows per table, e.g. 10000000')
+        parser.add_argument('--batch', type=int, default=10000, help='Rows per COPY')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('The UUID key benchmark needs PostgreSQL')
+        self.stdout.write(f'{"key":<8}{"rows":>12}{"seconds":>10}{"rows/s":>12}{"index MB":>11}{"table MB":>11}')
+        for name, generate in GENERATORS.items():
+            table = f'benchmark_{name}_keys'
+            with connection.cursor() as cursor:
+                cursor.execute(f'DROP TABLE IF EXISTS {table}')
+                # Same shape as the user-progress tables: uuid key, uuid FK, timestamp
+                cursor.execute(f'CREATE UNLOGGED TABLE {table} '
+                               f'(id uuid PRIMARY KEY, user_id uuid NOT NULL, created_at timestamptz NOT NULL)')
+                try:
+                    started = time.perf_counter()
+                    for start in range(0, options['rows'], options['batch']):
+                        count = min(options['batch'], options['rows'] - start)
+                        user_id = uuid.uuid4()
+                        buffer = io.StringIO(''.join(f'{generate()}\t{user_id}\tnow\n' for _ in range(count)))
+                        cursor.copy_expert(f'COPY {table} (id, user_id, created_at) FROM STDIN', buffer)
+                    seconds = time.perf_counter() - started
+                    cursor.execute(f"SELECT pg_relation_size('{table}_pkey'), pg_relation_size('{table}')")
+                    index_size, table_size = cursor.fetchone()
+                finally:
+                    cursor.execute(f'DROP TABLE IF EXISTS {table}')
+            self.stdout.write(f'{name:<8}{options["rows"]:>12}{seconds:>10.1f}{options["rows"] / seconds:>12.0f}'
+                              f'{index_size / 2 ** 20:>11.1f}{table_size / 2 ** 20:>11.1f}')
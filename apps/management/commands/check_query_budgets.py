@@ -0,0 +1,162 @@
+import re
+import time
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import (CaptureQueriesContext, override_settings,
+                               setup_databases, teardown_databases, )
+from django.urls import URLPattern, URLResolver, get_resolver
+from rest_framework.test import APIRequestFactory, force_authenticate
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from apps.models import User
+from apps.seed import PASSWORD, phone_number, seed
+
+LOCAL_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+# endpoint -> (method, role, kwargs, data, budget)
+# Every GET handler under apps/urls.py must be listed; a budget is the exact ceiling at every scale.
+BUDGETS = {
+    'UserViewSet.list': ('get', 'student', None, None, 1),
+    'UserViewSet.retrieve': ('get', 'student', lambda ids: {'pk': ids['student']}, None, 1),
+    'UserViewSet.get_me': ('get', 'student', None, None, 0),
+    'CourseModelViewSet.list': ('get', 'admin', None, None, 1),
+    'CourseModelViewSet.retrieve': ('get', 'admin', lambda ids: {'pk': ids['course']}, None, 1),
+    'ModuleModulViewSet.list': ('get', 'admin', None, None, 3),
+    'ModuleModulViewSet.retrieve': ('get', 'admin', lambda ids: {'pk': ids['module']}, None, 3),
+    'LessonModelViewSet.list': ('get', 'admin', None, None, 2),
+    'LessonModelViewSet.retrieve': ('get', 'admin', lambda ids: {'pk': ids['lesson']}, None, 2),
+    'TaskModulViewSet.list': ('get', 'admin', None, None, 1),
+    'TaskModulViewSet.retrieve': ('get', 'admin', lambda ids: {'pk': ids['task']}, None, 1),
+    'VideoModulViewSet.list': ('get', 'admin', None, None, 1),
+    'VideoModulViewSet.retrieve': ('get', 'admin', lambda ids: {'pk': ids['video']}, None, 1),
+    'CheckPhoneAPIView.list': ('post', None, None, lambda ids: {'phone_number': phone_number(2)}, 1),
+    'CustomTokenObtainPairView': ('post', None, None,
+                                  lambda ids: {'phone_number': phone_number(2), 'password': PASSWORD}, 2),
+    'TokenRefreshView': ('post', None, None, lambda ids: {'refresh': ids['refresh']}, 0),
+    'TokenVerifyView': ('post', None, None, lambda ids: {'token': ids['access']}, 0),
+    'CourseAllListAPIView': ('get', None, None, None, 2),
+    'CourseTreeAPIView': ('get', 'student', lambda ids: {'pk': ids['course']}, None, 4),
+    'DeviceModelListAPIView': ('get', 'student', None, None, 1),
+    'UserCourseListAPIView': ('get', 'student', None, None, 1),
+    'UserTaskRetrieveAPIView': ('get', 'student', lambda ids: {'lesson_id': ids['lesson']}, None, 3),
+    'UserModuleListAPIView': ('get', 'student', None, None, 1),
+    'UserCourseTeacherListAPIView': ('get', 'student', lambda ids: {'pk': ids['course']}, None, 1),
+    'LessonRetrieveAPIView': ('get', 'student', lambda ids: {'pk': ids['lesson']}, None, 4),
+    'TaskChatListAPIView': ('get', 'student', lambda ids: {'task_id': ids['task']}, None, 3),
+    'UnreadCountAPIView': ('get', 'student', None, None, 0),
+    'TeacherAPIView': ('get', 'student', None, None, 1),
+    'MyUserModelAPIView': ('get', 'student', None, None, 0),
+}
+
+
+def dataset(scale):
+    return {'courses': 2 * scale, 'modules': scale + 1, 'lessons': 2 * scale, 'videos': 2, 'tasks': 3,
+            'students': 3 * scale, 'enrollments': 2}
+
+
+def endpoints(patterns=None, prefix=''):
+    """Yield (endpoint, method, route, view) for every handler under apps/urls.py."""
+    for pattern in patterns if patterns is not None else get_resolver('apps.urls').url_patterns:
+        route = prefix + str(pattern.pattern)
+        if isinstance(pattern, URLResolver):
+            yield from endpoints(pattern.url_patterns, route)
+            continue
+        view_class = getattr(pattern.callback, 'cls', None)
+        if not isinstance(pattern, URLPattern) or view_class is None or 'format' in pattern.pattern.regex.groupindex:
+            continue
+        actions = getattr(pattern.callback, 'actions', None)
+        if actions:
+            for method, action in actions.items():
+                yield f'{view_class.__name__}.{action}', method, route, pattern.callback
+        else:
+            for method in view_class.http_method_names:
+                if method not in ('head', 'options') and hasattr(view_class, method):
+                    yield view_class.__name__, method, route, pattern.callback
+
+
+def build_path(route, kwargs):
+    path = re.sub(r'<(?:\w+:)?(\w+)>', lambda m: str(kwargs[m[1]]), route)
+    path = re.sub(r'\(\?P<(\w+)>[^)]*\)', lambda m: str(kwargs[m[1]]), path)
+    return '/api/v1/' + path.strip('^$')
+
+
+class Command(BaseCommand):
+    help = 'Call every API endpoint against seeded data at several scales and enforce per-endpoint query budgets'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scales', default='1,3', help='Comma separated dataset multipliers')
+        parser.add_argument('--keepdb', action='store_true', help='Reuse the test database')
+
+    def handle(self, *args, **options):
+        scales = [int(scale) for scale in options['scales'].split(',')]
+        found = {}
+        for endpoint, method, route, view in endpoints():
+            if endpoint == 'APIRootView':
+                continue
+            found.setdefault((endpoint, method), (route, view))
+        missing = sorted(endpoint for endpoint, method in found if method == 'get' and endpoint not in BUDGETS)
+        unknown = sorted(endpoint for endpoint, (method, *_) in BUDGETS.items() if (endpoint, method) not in found)
+        if missing or unknown:
+            raise CommandError(f'No budget declared for: {", ".join(missing) or "-"}; '
+                               f'declared but not routed: {", ".join(unknown) or "-"}')
+
+        old_config = setup_databases(0, False, keepdb=options['keepdb'])
+        try:
+            with override_settings(CACHES=LOCAL_CACHE):
+                results = {scale: self.measure(scale, found) for scale in scales}
+        finally:
+            teardown_databases(old_config, 0, keepdb=options['keepdb'])
+        self.report(scales, results)
+
+    def measure(self, scale, found):
+        factory = APIRequestFactory()
+        results = {}
+        with transaction.atomic():
+            ids = seed(**dataset(scale))
+            users = {role: User.objects.get(pk=ids[role]) for role in ('admin', 'student')}
+            refresh = RefreshToken.for_user(users['student'])
+            ids.update(refresh=str(refresh), access=str(refresh.access_token))
+
+            for endpoint, (method, role, kwargs, data, budget) in BUDGETS.items():
+                route, view = found[endpoint, method]
+                kwargs = kwargs(ids) if kwargs else {}
+                request = getattr(factory, method)(build_path(route, kwargs), data(ids) if data else None,
+                                                   format='json')
+                if role:
+                    force_authenticate(request, users[role])
+                cache.clear()
+                started = time.perf_counter()
+                with CaptureQueriesContext(connection) as queries:
+                    response = view(request, **kwargs)
+                    if hasattr(response, 'render'):
+                        response.render()
+                results[endpoint] = (len(queries), (time.perf_counter() - started) * 1000, len(response.content),
+                                     response.status_code)
+            transaction.set_rollback(True)
+        return results
+
+    def report(self, scales, results):
+        header = f'{"endpoint":<34}{"budget":>7}' + ''.join(f'{f"q@{scale}":>7}' for scale in scales)
+        header += f'{"ms":>9}{"bytes":>9}{"status":>7}  result'
+        self.stdout.write(header)
+        failures = []
+        for endpoint, (method, *_, budget) in BUDGETS.items():
+            counts = [results[scale][endpoint][0] for scale in scales]
+            _, ms, size, status = results[scales[-1]][endpoint]
+            problems = []
+            if max(counts) > budget:
+                problems.append('over budget')
+            if max(counts) > counts[0]:
+                problems.append('grows with rows')
+            if any(results[scale][endpoint][3] >= 400 for scale in scales):
+                problems.append(f'HTTP {status}')
+            line = f'{endpoint:<34}{budget:>7}' + ''.join(f'{count:>7}' for count in counts)
+            line += f'{ms:>9.1f}{size:>9}{status:>7}  {", ".join(problems) or "ok"}'
+            self.stdout.write(self.style.ERROR(line) if problems else line)
+            if problems:
+                failures.append(endpoint)
+        if failures:
+            raise CommandError(f'{len(failures)} endpoint(s) failed their query budget: {", ".join(failures)}')
+        self.stdout.write(self.style.SUCCESS(f'All {len(BUDGETS)} endpoints within budget'))
@@ -0,0 +1,135 @@
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import setup_databases, teardown_databases
+
+from apps.management.commands.check_query_budgets import dataset
+from apps.models import (Lesson, Module, Payment, Task, User, UserCourseProgress,
+                         UserLesson, Video, )
+from apps.seed import seed
+
+SNAPSHOT = 'benchmarks/query_plans.json'
+
+# name -> (queryset built from the seeded ids, model, the field lists of the indexes that may serve it);
+# the hot filters behind the API and admin
+QUERIES = {
+    'user-task list': (lambda ids: Task.objects.filter(lesson_id=ids['lesson'], must_complete=False).order_by('order'),
+                       Task, [('lesson', 'must_complete', 'order')]),
+    'course modules': (lambda ids: Module.objects.filter(course_id=ids['course']).order_by('order'),
+                       Module, [('course', 'order')]),
+    'module lessons': (lambda ids: Lesson.objects.filter(module_id=ids['module']).order_by('order'),
+                       Lesson, [('module', 'order')]),
+    'lesson videos': (lambda ids: Video.objects.filter(lesson_id=ids['lesson']).order_by('order'),
+                      Video, [('lesson', 'order')]),
+    'teachers': (lambda ids: User.objects.filter(type=User.UserType.TEACHER).order_by('date_joined', 'id'),
+                 User, [('type', 'date_joined', 'id')]),
+    'finished lessons': (lambda ids: UserLesson.objects.filter(user_id=ids['student'],
+                                                               status=UserLesson.StatusChoices.FINISHED),
+                         UserLesson, [('user', 'status')]),
+    'user payments': (lambda ids: Payment.objects.filter(user_id=ids['student']).order_by('-processed_date'),
+                      Payment, [('user', 'processed_date')]),
+    'my courses': (lambda ids: UserCourseProgress.objects.filter(user_id=ids['student']),
+                   UserCourseProgress, [('user',), ('user', 'course')]),
+}
+
+# Names of the indexes of a table, keyed by their column lists; Django hashes generated names
+INDEXES_SQL = '''
+SELECT i.relname, ARRAY(
+    SELECT a.attname FROM unnest(x.indkey) WITH ORDINALITY AS k(attnum, position)
+    JOIN pg_attribute a ON a.attrelid = x.indrelid AND a.attnum = k.attnum
+    ORDER BY k.position
+)::text[]
+FROM pg_index x
+JOIN pg_class i ON i.oid = x.indexrelid
+JOIN pg_class t ON t.oid = x.indrelid
+WHERE t.relname = %s
+'''
+
+
+def expected_indexes(cursor, model, field_lists):
+    cursor.execute(INDEXES_SQL, [model._meta.db_table])
+    by_columns = {tuple(columns): name for name, columns in cursor.fetchall()}
+    columns = [tuple(model._meta.get_field(field).column for field in fields) for fields in field_lists]
+    return [by_columns.get(index, f'<no index on {model._meta.db_table}({", ".join(index)})>') for index in columns]
+
+
+def plan_nodes(plan):
+    """Flatten an EXPLAIN (FORMAT JSON) plan into 'Node Type [using index] [on table]' lines."""
+    line = plan['Node Type']
+    if 'Index Name' in plan:
+        line += f' using {plan["Index Name"]}'
+    if 'Relation Name' in plan:
+        line += f' on {plan["Relation Name"]}'
+    yield line
+    for child in plan.get('Plans', ()):
+        yield from plan_nodes(child)
+
+
+class Command(BaseCommand):
+    help = 'EXPLAIN the hot queries against seeded data; fail unless each uses its index and matches the snapshot'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', type=int, default=3, help='Dataset multiplier, as in check_query_budgets')
+        parser.add_argument('--snapshot', default=SNAPSHOT)
+        parser.add_argument('--update', action='store_true', help='Write the current plans to the snapshot')
+        parser.add_argument('--keepdb', action='store_true', help='Reuse the test database')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('Query plans are only checked on PostgreSQL')
+        old_config = setup_databases(0, False, keepdb=options['keepdb'])
+        try:
+            plans, indexes = self.explain(options['scale'])
+        finally:
+            teardown_databases(old_config, 0, keepdb=options['keepdb'])
+
+        if options['update']:
+            os.makedirs(os.path.dirname(options['snapshot']) or '.', exist_ok=True)
+            with open(options['snapshot'], 'w') as f:
+                json.dump(plans, f, indent=2)
+            self.stdout.write(f'Plans written to {options["snapshot"]}')
+        self.report(plans, indexes, options['snapshot'])
+
+    def explain(self, scale):
+        plans, indexes = {}, {}
+        with transaction.atomic():
+            ids = seed(**dataset(scale))
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+                # Tiny tables are cheaper to scan, so ask the planner to use an index whenever one fits;
+                # a Seq Scan that remains means no index can serve the query
+                cursor.execute('SET LOCAL enable_seqscan = off')
+                for name, (queryset, model, field_lists) in QUERIES.items():
+                    indexes[name] = expected_indexes(cursor, model, field_lists)
+                    plan = json.loads(queryset(ids).explain(format='json'))[0]['Plan']
+                    plans[name] = list(plan_nodes(plan))
+            transaction.set_rollback(True)
+        return plans, indexes
+
+    def report(self, plans, indexes, snapshot):
+        try:
+            with open(snapshot) as f:
+                expected = json.load(f)
+        except FileNotFoundError:
+            expected = None
+            self.stdout.write(f'No snapshot at {snapshot}, create one with --update')
+
+        failures = []
+        for name, nodes in plans.items():
+            # Dropping an index the query was meant to use fails even if another one still avoids a Seq Scan
+            used = any(node.split(' on ')[0].endswith(f' using {index}') for node in nodes for index in indexes[name])
+            changed = expected is not None and expected.get(name) not in (None, nodes)
+            line = f'{name:<20}{"; ".join(nodes)}'
+            if not used:
+                failures.append(name)
+                self.stdout.write(self.style.ERROR(f'{line}  <- expected: {" or ".join(indexes[name])}'))
+            elif changed:
+                failures.append(name)
+                self.stdout.write(self.style.ERROR(f'{line}  <- was: {"; ".join(expected[name])}'))
+            else:
+                self.stdout.write(line)
+        if failures:
+            raise CommandError(f'Unexpected plans for: {", ".join(failures)}; if intended, rerun with --update')
+        self.stdout.write(self.style.SUCCESS(f'All {len(plans)} queries use their indexes'))
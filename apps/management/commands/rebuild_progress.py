@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from apps import progress
+
+
+class Command(BaseCommand):
+    help = 'Recompute UserCourseProgress rows from UserLesson and UserTask'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--course', help='Only rebuild progress for this course id')
+        parser.add_argument('--missing', action='store_true',
+                            help='Only create the rows of enrollments that have none (run on every deploy)')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            rows = progress.rebuild(options['course'], missing_only=options['missing'])
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {rows} progress rows'))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from apps import unlock
+
+
+class Command(BaseCommand):
+    help = 'Recompute lesson, module and course statuses from finished must-complete tasks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--course', help='Only re-evaluate this course id')
+
+    def handle(self, *args, **options):
+        for course_id, changed in unlock.reevaluate(options['course']).items():
+            self.stdout.write(f'{course_id}: {changed} statuses changed')
+        self.stdout.write(self.style.SUCCESS('Done'))
@@ -0,0 +1,53 @@
+import time
+from collections import Counter
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from apps import bulk
+from apps.seed import seed
+
+
+class Command(BaseCommand):
+    help = 'Generate a large deterministic dataset for performance work (COPY on Postgres, bulk_create elsewhere)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10000, help='Number of students')
+        parser.add_argument('--courses', type=int, default=20)
+        parser.add_argument('--modules', type=int, default=8, help='Modules per course')
+        parser.add_argument('--lessons', type=int, default=10, help='Lessons per module')
+        parser.add_argument('--videos', type=int, default=2, help='Videos per lesson')
+        parser.add_argument('--tasks', type=int, default=3, help='Tasks per lesson')
+        parser.add_argument('--enrollments', type=int, default=3, help='Most courses one student takes')
+        parser.add_argument('--payments', type=int, default=2, help='Average payments per student')
+        parser.add_argument('--chats', type=int, default=1, help='Average chat messages per finished task')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--no-copy', action='store_true', help='Use bulk_create even on Postgres')
+
+    def handle(self, *args, **options):
+        rows = Counter()
+        use_copy = not options['no_copy']
+
+        def write(model, objs):
+            if objs:
+                bulk.insert(model, objs, use_copy=use_copy)
+                rows[model._meta.label] += len(objs)
+
+        started = time.perf_counter()
+        with transaction.atomic():
+            seed(courses=options['courses'], modules=options['modules'], lessons=options['lessons'],
+                 videos=options['videos'], tasks=options['tasks'], students=options['users'],
+                 enrollments=options['enrollments'], payments=options['payments'], chats=options['chats'],
+                 seed=options['seed'], write=write)
+        seconds = time.perf_counter() - started
+
+        if connection.vendor == 'postgresql':
+            # Fresh planner statistics for the new tables (and for ?count=estimate)
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+        for label, count in sorted(rows.items()):
+            self.stdout.write(f'{label:<28}{count:>12}')
+        total = sum(rows.values())
+        self.stdout.write(self.style.SUCCESS(
+            f'Inserted {total} rows in {seconds:.1f}s ({total / seconds:.0f} rows/s)' if seconds else
+            f'Inserted {total} rows'))
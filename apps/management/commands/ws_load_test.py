@@ -0,0 +1,120 @@
+import asyncio
+import json
+import resource
+import time
+
+import aiohttp
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.management.commands.benchmark import percentile
+
+
+def rss_bytes(pid):
+    with open(f'/proc/{pid}/statm') as f:
+        return int(f.read().split()[1]) * resource.getpagesize()
+
+
+def raise_open_files_limit():
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    return resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+
+
+class Command(BaseCommand):
+    help = 'Open many concurrent /ws/chat/<room>/ connections and measure connect latency, fan-out latency and ' \
+           'memory per connection'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='ws://localhost:8000', help='Server to connect to')
+        parser.add_argument('--connections', type=int, default=10000)
+        parser.add_argument('--rooms', type=int, default=100, help='Connections are spread evenly over the rooms')
+        parser.add_argument('--messages', type=int, default=10, help='Messages sent into every room')
+        parser.add_argument('--interval', type=float, default=0.5, help='Seconds between messages of one room')
+        parser.add_argument('--connect-concurrency', type=int, default=500, help='Handshakes in flight at once')
+        parser.add_argument('--drain', type=float, default=5.0, help='Seconds to wait for the last deliveries')
+        parser.add_argument('--token', required=True,
+                            help='JWT access or durin token of a staff or teacher user; students may only '
+                                 'join rooms of their own tasks')
+        parser.add_argument('--pid', type=int, action='append', default=[],
+                            help='Server process to sample RSS from, repeat for every worker')
+
+    def handle(self, *args, **options):
+        limit = raise_open_files_limit()
+        if limit < options['connections'] + 100:
+            raise CommandError(f'Open file limit is {limit}, raise it (ulimit -n) above --connections')
+        asyncio.run(self.run(options))
+
+    async def run(self, options):
+        self.connect_ms, self.delivery_ms, self.failures = [], [], 0
+        rooms = {}
+        server_before = sum(rss_bytes(pid) for pid in options['pid'])
+        client_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        semaphore = asyncio.Semaphore(options['connect_concurrency'])
+
+        async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0)) as session:
+            async def open_one(index):
+                room = f'load{index % options["rooms"]}'
+                async with semaphore:
+                    started = time.perf_counter()
+                    try:
+                        ws = await session.ws_connect(f'{options["url"].rstrip("/")}/ws/chat/{room}/',
+                                                      params={'token': options['token']})
+                    except (aiohttp.ClientError, asyncio.TimeoutError):
+                        self.failures += 1
+                        return
+                    self.connect_ms.append((time.perf_counter() - started) * 1000)
+                rooms.setdefault(room, []).append(ws)
+                readers.append(asyncio.create_task(self.read(ws)))
+
+            readers = []
+            started = time.perf_counter()
+            await asyncio.gather(*(open_one(index) for index in range(options['connections'])))
+            connect_seconds = time.perf_counter() - started
+            connected = len(self.connect_ms)
+            # Let the server finish its group_add calls before measuring
+            await asyncio.sleep(1)
+            server_after = sum(rss_bytes(pid) for pid in options['pid'])
+            client_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+            expected = sum(len(members) for members in rooms.values()) * options['messages']
+            await asyncio.gather(*(self.send(members[0], options) for members in rooms.values()))
+            await asyncio.sleep(options['drain'])
+
+            for members in rooms.values():
+                for ws in members:
+                    await ws.close()
+            for reader in readers:
+                reader.cancel()
+
+        self.report(connected, connect_seconds, expected, options,
+                    (server_after - server_before) if options['pid'] else None, client_after - client_before)
+
+    async def read(self, ws):
+        async for message in ws:
+            if message.type != aiohttp.WSMsgType.TEXT:
+                continue
+            payload = json.loads(message.data).get('message')
+            if isinstance(payload, dict) and 'sent' in payload:
+                self.delivery_ms.append((time.time() - payload['sent']) * 1000)
+
+    async def send(self, ws, options):
+        for number in range(options['messages']):
+            await ws.send_json({'message': {'sent': time.time(), 'number': number}})
+            await asyncio.sleep(options['interval'])
+
+    def report(self, connected, connect_seconds, expected, options, server_bytes, client_bytes):
+        self.stdout.write(f'connections   {connected} open, {self.failures} failed in {connect_seconds:.1f}s '
+                          f'({connected / connect_seconds:.0f}/s)')
+        for label, values in (('connect ms', self.connect_ms), ('fan-out ms', self.delivery_ms)):
+            values.sort()
+            if values:
+                self.stdout.write(f'{label:<14}p50 {percentile(values, 0.5):.1f}  p95 {percentile(values, 0.95):.1f}'
+                                  f'  p99 {percentile(values, 0.99):.1f}  max {values[-1]:.1f}')
+        self.stdout.write(f'deliveries    {len(self.delivery_ms)} of {expected}')
+        if server_bytes is not None and connected:
+            self.stdout.write(f'server memory {server_bytes / connected / 1024:.1f} KiB per connection')
+        if connected:
+            self.stdout.write(f'client memory {client_bytes / connected / 1024:.1f} KiB per connection')
+        if self.failures or len(self.delivery_ms) < expected:
+            raise CommandError('Some connections or deliveries failed')
@@ -1,5 +1,6 @@
 from django.contrib.auth.base_user import BaseUserManager
 from django.contrib.auth.hashers import make_password
+from django.db.models import Prefetch, QuerySet
 
 
 class CustomUserManager(BaseUserManager):
@@ -25,3 +26,19 @@ class CustomUserManager(BaseUserManager):
         if extra_fields.get("is_superuser") is not True:
             raise ValueError("Superuser must have is_superuser=True.")
         return self._create_user(phone_number, password, **extra_fields)
+
+
+class ModuleQuerySet(QuerySet):
+    def with_lessons(self):
+        from apps.models import Lesson, Video
+
+        videos = Video.objects.order_by('order')
+        lessons = Lesson.objects.order_by('order').prefetch_related(Prefetch('video_set', queryset=videos))
+        return self.order_by('order').prefetch_related(Prefetch('lesson_set', queryset=lessons))
+
+
+class CourseQuerySet(QuerySet):
+    def with_tree(self):
+        from apps.models import Module
+
+        return self.prefetch_related(Prefetch('module_set', queryset=Module.objects.with_lessons()))
@@ -0,0 +1,118 @@
+import os
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, HttpResponseForbidden
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry,
+                               Counter, Gauge, Histogram, generate_latest, )
+from prometheus_client.multiprocess import MultiProcessCollector
+from rest_framework.serializers import BaseSerializer
+
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200, 500)
+
+REQUEST_LATENCY = Histogram('http_request_duration_seconds', 'Request latency', ['view', 'method'])
+REQUESTS = Counter('http_requests', 'Requests by status code', ['view', 'method', 'status'])
+SQL_QUERIES = Histogram('http_request_sql_queries', 'SQL queries per request', ['view'], buckets=QUERY_BUCKETS)
+SQL_SECONDS = Histogram('http_request_sql_seconds', 'Time spent in SQL per request', ['view'])
+SERIALIZER_SECONDS = Histogram('http_request_serializer_seconds', 'Time spent in serializer .data', ['view'])
+RESPONSE_SIZE = Histogram('http_response_size_bytes', 'Response body size', ['view'], buckets=SIZE_BUCKETS)
+CACHE_EVENTS = Counter('cache_events', 'Two-tier cache lookups by key namespace', ['namespace', 'event'])
+DB_POOL_WAIT = Histogram('db_pool_wait_seconds', 'Time spent waiting for a pooled connection', ['alias'],
+                         buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10))
+DB_POOL_CONNECTIONS = Gauge('db_pool_connections', 'Pooled connections by state', ['alias', 'state'],
+                            multiprocess_mode='livesum')
+DB_POOL_MAX_SIZE = Gauge('db_pool_max_size', 'Pool size limit summed over processes', ['alias'],
+                         multiprocess_mode='livesum')
+DB_POOL_TIMEOUTS = Counter('db_pool_timeouts', 'Checkouts that gave up waiting for a connection', ['alias'])
+DB_POOL_HEALTH_FAILURES = Counter('db_pool_health_check_failures', 'Idle connections that failed the ping',
+                                  ['alias'])
+WS_AUTH = Counter('websocket_auth', 'Websocket handshakes by token authentication result', ['result'])
+
+current_request = ContextVar('current_request', default=None)
+serializer_depth = ContextVar('serializer_depth', default=0)
+
+
+class RequestStats:
+    __slots__ = ('queries', 'sql_seconds', 'serializer_seconds', 'seconds')
+
+    def __init__(self):
+        self.seconds = 0.0
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.serializer_seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        # connection.execute_wrapper hook
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.sql_seconds += time.perf_counter() - started
+
+
+def record_query(execute, sql, params, many, context):
+    # Installed on every connection, so queries count whichever thread runs them; under ASGI
+    # sync views run in a sync_to_async thread that inherits the request's context
+    stats = current_request.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    return stats(execute, sql, params, many, context)
+
+
+def instrument_connection(sender, connection, **kwargs):
+    # connection_created fires again on every reconnect of the same wrapper
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def instrument_serializers():
+    """Time top-level serializer.data calls made while a request is being recorded."""
+    data = BaseSerializer.data
+
+    def timed_data(serializer):
+        stats = current_request.get()
+        # Nested serializers read .data inside an outer one; their time is already counted there
+        if stats is None or serializer_depth.get():
+            return data.fget(serializer)
+        token = serializer_depth.set(1)
+        started = time.perf_counter()
+        try:
+            return data.fget(serializer)
+        finally:
+            stats.serializer_seconds += time.perf_counter() - started
+            serializer_depth.reset(token)
+
+    BaseSerializer.data = property(timed_data)
+
+
+_cache_seen = {}
+
+
+def export_cache_stats():
+    # The backend keeps cumulative per-process totals; push only what changed since the last call
+    if not hasattr(cache, 'stats'):
+        return
+    for namespace, events in cache.stats().items():
+        for event, total in events.items():
+            delta = total - _cache_seen.get((namespace, event), 0)
+            if delta > 0:
+                CACHE_EVENTS.labels(namespace, event).inc(delta)
+                _cache_seen[namespace, event] = total
+
+
+def metrics_view(request):
+    # Closed unless a token is configured; the stats show every view's latency and SQL use
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    if not token or request.headers.get('Authorization') != f'Bearer {token}':
+        return HttpResponseForbidden()
+    export_cache_stats()
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return HttpResponse(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
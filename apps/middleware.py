@@ -0,0 +1,204 @@
+import cProfile
+import os
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from asgiref.sync import (iscoroutinefunction, markcoroutinefunction,
+                          sync_to_async, )
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from apps import metrics
+from apps.db import router
+
+
+def view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return '<unresolved>'
+    view_class = getattr(match.func, 'cls', None)
+    if view_class is None:
+        return match.view_name or match.func.__name__
+    actions = getattr(match.func, 'actions', None)
+    if actions and request.method.lower() in actions:
+        return f'{view_class.__name__}.{actions[request.method.lower()]}'
+    return view_class.__name__
+
+
+class SlowRequestProfiler:
+    """
+    Profile a random sample of requests and keep the dumps of those at or above the
+    rolling p99 latency of this process. Dumps are pstats files named after the view.
+    """
+
+    def __init__(self, directory, sample_rate, window=1000, min_samples=100):
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.min_samples = min_samples
+        self.latencies = deque(maxlen=window)
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def threshold(self):
+        with self.lock:
+            if len(self.latencies) < self.min_samples:
+                return None
+            latencies = sorted(self.latencies)
+        return latencies[int(len(latencies) * 0.99)]
+
+    def record(self, name, seconds, profile):
+        threshold = self.threshold()
+        with self.lock:
+            self.latencies.append(seconds)
+        if profile is not None and threshold is not None and seconds >= threshold:
+            filename = f'{name.replace(".", "-")}-{int(seconds * 1000)}ms-{int(time.time())}-{os.getpid()}.prof'
+            profile.dump_stats(os.path.join(self.directory, filename))
+
+    def start(self):
+        if random.random() >= self.sample_rate:
+            return None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler is already active in this thread
+            return None
+        return profile
+
+
+class MetricsMiddleware:
+    """Record latency, SQL count/time, serializer time and response size per resolved view."""
+
+    sync_capable = True
+    async_capable = True
+    cache_stats_interval = 1.0
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+        directory = getattr(settings, 'PROFILE_DIR', None)
+        sample_rate = getattr(settings, 'PROFILE_SAMPLE_RATE', 0)
+        self.profiler = SlowRequestProfiler(directory, sample_rate) if directory and sample_rate else None
+        self.cache_stats_exported = 0
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        profile = self.profiler.start() if self.profiler else None
+        try:
+            with self.measure() as stats:
+                response = self.get_response(request)
+        finally:
+            if profile is not None:
+                profile.disable()
+        self.observe(request, response, stats, profile)
+        return response
+
+    async def __acall__(self, request):
+        # cProfile follows a thread, not a coroutine, so async requests are never sampled
+        with self.measure() as stats:
+            response = await self.get_response(request)
+        self.observe(request, response, stats, None)
+        return response
+
+    @contextmanager
+    def measure(self):
+        stats = metrics.RequestStats()
+        token = metrics.current_request.set(stats)
+        started = time.perf_counter()
+        try:
+            # Queries are counted by metrics.record_query on the connections themselves
+            yield stats
+        finally:
+            stats.seconds = time.perf_counter() - started
+            metrics.current_request.reset(token)
+
+    def observe(self, request, response, stats, profile):
+        name = view_name(request)
+        metrics.REQUEST_LATENCY.labels(name, request.method).observe(stats.seconds)
+        metrics.REQUESTS.labels(name, request.method, response.status_code).inc()
+        metrics.SQL_QUERIES.labels(name).observe(stats.queries)
+        metrics.SQL_SECONDS.labels(name).observe(stats.sql_seconds)
+        metrics.SERIALIZER_SECONDS.labels(name).observe(stats.serializer_seconds)
+        if not response.streaming:
+            metrics.RESPONSE_SIZE.labels(name).observe(len(response.content))
+        if self.profiler and profile is not None:
+            self.profiler.record(name, stats.seconds, profile)
+        if time.monotonic() - self.cache_stats_exported > self.cache_stats_interval:
+            self.cache_stats_exported = time.monotonic()
+            metrics.export_cache_stats()
+
+
+def jwt_user_id(request):
+    """User id claim of a valid JWT access token in the Authorization header."""
+    header = request.headers.get('Authorization', '').split()
+    if len(header) != 2 or header[0] not in jwt_settings.AUTH_HEADER_TYPES:
+        return None
+    try:
+        return str(AccessToken(header[1])[jwt_settings.USER_ID_CLAIM])
+    except (TokenError, KeyError):
+        return None
+
+
+def request_user_id(request):
+    """User id from the JWT access token or the session, without touching the user table."""
+    if request.headers.get('Authorization'):
+        return jwt_user_id(request)
+    if hasattr(request, 'session'):
+        return request.session.get(SESSION_KEY)
+    return None
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Let safe requests read from replicas unless their user wrote recently, and pin users
+    to the primary after their own successful writes.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not settings.DATABASE_REPLICAS:
+            return self.get_response(request)
+        allowed, user_id = self.replica_reads(request)
+        with router.use_replicas(allowed):
+            response = self.get_response(request)
+        self.pin_writer(request, response, user_id)
+        return response
+
+    async def __acall__(self, request):
+        if not settings.DATABASE_REPLICAS:
+            return await self.get_response(request)
+        # Session and cache lookups are blocking
+        allowed, user_id = await sync_to_async(self.replica_reads)(request)
+        with router.use_replicas(allowed):
+            response = await self.get_response(request)
+        await sync_to_async(self.pin_writer)(request, response, user_id)
+        return response
+
+    def replica_reads(self, request):
+        user_id = request_user_id(request)
+        return request.method in SAFE_METHODS and not router.is_pinned(user_id), user_id
+
+    def pin_writer(self, request, response, user_id):
+        if request.method not in SAFE_METHODS and response.status_code < 400:
+            user = getattr(request, 'user', None)
+            router.pin_primary(user.pk if user is not None and user.is_authenticated else user_id)
@@ -0,0 +1,56 @@
+import hashlib
+
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+from apps import counters
+
+
+def conditional_validators(request, parts, last_modified):
+    """Turn validator parts and a last modified datetime into (etag, timestamp) for the request."""
+    etag = quote_etag(hashlib.md5(repr((request.get_full_path(), *parts)).encode()).hexdigest())
+    timestamp = int(last_modified.timestamp()) if last_modified else None
+    return etag, timestamp
+
+
+def set_validators(response, etag, timestamp):
+    if response.status_code in (200, 304):
+        response['ETag'] = etag
+        if timestamp:
+            response['Last-Modified'] = http_date(timestamp)
+    return response
+
+
+class ConditionalGetMixin:
+    """Answer 304 Not Modified from cheap validators before the queryset and serializer run."""
+
+    def get_validators(self):
+        """Return (etag parts, last modified datetime), or None to skip conditional handling."""
+        return None
+
+    def get(self, request, *args, **kwargs):
+        validators = self.get_validators()
+        if validators is None:
+            return super().get(request, *args, **kwargs)
+        etag, timestamp = conditional_validators(request, *validators)
+
+        response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+        if response is None:
+            response = super().get(request, *args, **kwargs)
+        return set_validators(response, etag, timestamp)
+
+
+class DeferredCountersMixin:
+    """Batch the counter updates of a viewset write; deleting a course cascades to every lesson and task."""
+
+    def perform_create(self, serializer):
+        with counters.deferred():
+            super().perform_create(serializer)
+
+    def perform_update(self, serializer):
+        with counters.deferred():
+            super().perform_update(serializer)
+
+    def perform_destroy(self, instance):
+        with counters.deferred():
+            super().perform_destroy(instance)
@@ -1,19 +1,37 @@
+import os
+import time
 import uuid
 from datetime import timedelta
 
 from django.contrib.auth.models import AbstractUser
 from django.core.validators import FileExtensionValidator, RegexValidator
-from django.db.models import (CASCADE, BooleanField, CharField, DateField,
+from django.db.models import (CASCADE, SET_NULL, BooleanField, CharField, DateField,
                               DateTimeField, FileField, ForeignKey, ImageField,
-                              IntegerField, ManyToManyField, Model,
+                              Index, IntegerField, ManyToManyField, Model,
                               PositiveIntegerField, SlugField, TextChoices,
                               TextField, URLField, UUIDField, )
 from django.utils.text import slugify
 from django.utils.translation import gettext_lazy as _
 from parler.models import TranslatableModel
 
-from apps.managers import CustomUserManager
-from django.db import models
+from apps.managers import CourseQuerySet, CustomUserManager, ModuleQuerySet
+
+
+def uuid7():
+    """
+    Time-ordered UUID (RFC 9562 version 7): 48-bit Unix milliseconds, then random bits.
+    New rows land at the right edge of the primary key index instead of all over it.
+    """
+    value = (time.time_ns() // 1_000_000) << 80 | int.from_bytes(os.urandom(10), 'big')
+    value = value & ~(0xF << 76) | 0x7 << 76  # version
+    value = value & ~(0x3 << 62) | 0x2 << 62  # RFC 4122 variant
+    return uuid.UUID(int=value)
+
+
+def progress_percent(finished, total):
+    if not total:
+        return 0
+    return min(100, finished * 100 // total)
 
 
 class CreatedBaseModel(Model):
@@ -24,6 +42,15 @@ class CreatedBaseModel(Model):
         abstract = True
 
 
+class LoadedValuesMixin:
+    # Remembers the values a row was loaded with so signals can tell what changed
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+
 class User(AbstractUser):
     class UserType(TextChoices):
         ADMIN = 'admin', _('Admin')
@@ -54,6 +81,11 @@ class User(AbstractUser):
     class Meta:
         verbose_name = _("user")
         verbose_name_plural = _("users")
+        indexes = [
+            Index(fields=['date_joined', 'id']),
+            # Proxy admins and TeacherAPIView filter on type and page by date_joined
+            Index(fields=['type', 'date_joined', 'id']),
+        ]
 
     def delete(self, using=None, keep_parents=False):
         self.photo.delete(save=False)
@@ -96,16 +128,19 @@ class Course(CreatedBaseModel):
     task_count = PositiveIntegerField(default=0, verbose_name=_('task_count'))
     url = URLField(max_length=255, verbose_name=_('url'))
 
+    objects = CourseQuerySet.as_manager()
+
     class Meta:
         verbose_name = _("Course")
         verbose_name_plural = _("Courses")
+        indexes = [Index(fields=['order', 'id'])]
 
     def __str__(self):
         return self.title
 
 
 class UserCourse(CreatedBaseModel):
-    id = UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    id = UUIDField(primary_key=True, default=uuid7, editable=False)
 
     class StatusChoices(TextChoices):
         BLOCKED = "blocked", _('Blocked')
@@ -130,9 +165,24 @@ class UserCourse(CreatedBaseModel):
         else:
             return None
 
-    def save(self, *args, **kwargs):
-        self.slug = slugify(self.course.title)
-        super(UserCourse, self).save(*args, **kwargs)
+
+class UserCourseProgress(CreatedBaseModel):
+    id = UUIDField(primary_key=True, default=uuid7, editable=False)
+    user = ForeignKey('apps.User', CASCADE, verbose_name=_('user_progress'))
+    course = ForeignKey('apps.Course', CASCADE, verbose_name=_('course_progress'))
+    finished_lessons = PositiveIntegerField(default=0, verbose_name=_('finished_lessons'))
+    finished_tasks = PositiveIntegerField(default=0, verbose_name=_('finished_tasks'))
+    next_lesson = ForeignKey('apps.Lesson', SET_NULL, null=True, blank=True, related_name='+',
+                             verbose_name=_('next_lesson'))
+
+    class Meta:
+        verbose_name = _("User Course Progress")
+        verbose_name_plural = _("User Course Progress")
+        unique_together = ('user', 'course')
+
+    @property
+    def percent(self):
+        return progress_percent(self.finished_lessons, self.course.lesson_count)
 
 
 class Module(CreatedBaseModel):
@@ -148,6 +198,8 @@ class Module(CreatedBaseModel):
     course = ForeignKey('apps.Course', CASCADE, verbose_name=_('course_module'))
     slug = SlugField(max_length=100, editable=False)  # add slug  in  fixture
 
+    objects = ModuleQuerySet.as_manager()
+
     def save(self, *args, **kwargs):
         if not self.slug:
             self.slug = slugify(self.title)
@@ -156,13 +208,14 @@ class Module(CreatedBaseModel):
     class Meta:
         verbose_name = _("Module")
         verbose_name_plural = _("Modules")
+        indexes = [Index(fields=['course', 'order'])]
 
     def __str__(self):
         return self.title
 
 
 class UserModule(CreatedBaseModel):
-    id = UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    id = UUIDField(primary_key=True, default=uuid7, editable=False)
 
     class StatusChoices(TextChoices):
         BLOCKED = "blocked", _('Blocked')
@@ -179,10 +232,6 @@ class UserModule(CreatedBaseModel):
         verbose_name_plural = _("User Modules")
         unique_together = ('user', 'module')
 
-    def save(self, *args, **kwargs):
-        self.slug = slugify(self.module.title)
-        super(UserModule, self).save(*args, **kwargs)
-
 
 class Lesson(CreatedBaseModel):
     id = UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -199,6 +248,7 @@ class Lesson(CreatedBaseModel):
     class Meta:
         verbose_name = _('Lesson')
         verbose_name_plural = _('Lessons')
+        indexes = [Index(fields=['created_at', 'id']), Index(fields=['module', 'order'])]
 
     def __str__(self):
         return self.title
@@ -214,8 +264,8 @@ def validate_file_extension(value):
         raise ValidationError('Unsupported file extension.')
 
 
-class UserLesson(CreatedBaseModel):
-    id = UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+class UserLesson(LoadedValuesMixin, CreatedBaseModel):
+    id = UUIDField(primary_key=True, default=uuid7, editable=False)
 
     class StatusChoices(TextChoices):
         BLOCKED = "blocked", _('Blocked')
@@ -232,6 +282,7 @@ class UserLesson(CreatedBaseModel):
         unique_together = ('user', 'lesson')
         verbose_name = _('UserLesson')
         verbose_name_plural = _('UserLessons')
+        indexes = [Index(fields=['user', 'status'])]
 
 
 class LessonQuestion(CreatedBaseModel):
@@ -263,12 +314,8 @@ class Video(CreatedBaseModel):
     def __str__(self):
         return self.lesson.title
 
-    def save(self, *args, **kwargs):
-        # New video being added
-        if not self.pk:
-            self.lesson.video_count = models.F('video_count') + 1
-            self.lesson.save(update_fields=['video_count'])
-        super().save(*args, **kwargs)
+    class Meta:
+        indexes = [Index(fields=['created_at', 'id']), Index(fields=['lesson', 'order'])]
 
 
 class Task(CreatedBaseModel):
@@ -288,13 +335,14 @@ class Task(CreatedBaseModel):
     class Meta:
         verbose_name = _('Task')
         verbose_name_plural = _('Task')
+        indexes = [Index(fields=['created_at', 'id']), Index(fields=['lesson', 'must_complete', 'order'])]
 
     def __str__(self):
         return self.title
 
 
-class UserTask(CreatedBaseModel):
-    id = UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+class UserTask(LoadedValuesMixin, CreatedBaseModel):
+    id = UUIDField(primary_key=True, default=uuid7, editable=False)
     user = ForeignKey('apps.User', CASCADE, verbose_name=_('user_userTask'))
     task = ForeignKey('apps.Task', CASCADE, verbose_name=_('task_user_task'))
     finished = BooleanField(verbose_name=_('finished'), default=False)
@@ -306,7 +354,7 @@ class UserTask(CreatedBaseModel):
 
 
 class TaskChat(CreatedBaseModel):
-    id = UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    id = UUIDField(primary_key=True, default=uuid7, editable=False)
     text = CharField(verbose_name=_('text'), max_length=255)
     user = ForeignKey('apps.User', CASCADE, verbose_name=_('user_taskChat'))
     task = ForeignKey('apps.Task', CASCADE, verbose_name=_('task_taskChat'))
@@ -319,10 +367,11 @@ class TaskChat(CreatedBaseModel):
     class Meta:
         verbose_name = _('TaskChat')
         verbose_name_plural = _('TaskChat')
+        indexes = [Index(fields=['task', 'created_at', 'id'])]
 
 
 class Payment(CreatedBaseModel):
-    id = UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    id = UUIDField(primary_key=True, default=uuid7, editable=False)
     reason = CharField(verbose_name=_('reason'), max_length=255)
     expend = CharField(verbose_name=_('expend'), max_length=255)
     balance = PositiveIntegerField(verbose_name=_('balance'))
@@ -336,10 +385,11 @@ class Payment(CreatedBaseModel):
     class Meta:
         verbose_name = _('Payment')
         verbose_name_plural = _('Payments')
+        indexes = [Index(fields=['user', 'processed_date'])]
 
 
 class Device(CreatedBaseModel):
-    id = UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    id = UUIDField(primary_key=True, default=uuid7, editable=False)
     title = CharField(verbose_name=_('title_device'), max_length=255)
     user = ForeignKey('apps.User', CASCADE, verbose_name=_('user_device'))
 
@@ -0,0 +1,47 @@
+from django.db import connection
+from rest_framework.pagination import CursorPagination
+
+
+def estimate_count(model):
+    # Planner statistics instead of COUNT(*); -1 means the table was never analyzed
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', [model._meta.db_table])
+        row = cursor.fetchone()
+    if row is None or row[0] < 0:
+        return None
+    return row[0]
+
+
+class CreatedAtCursorPagination(CursorPagination):
+    ordering = ('-created_at', '-id')
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+    count_query_param = 'count'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.model = queryset.model
+        self.with_estimate = request.query_params.get(self.count_query_param) == 'estimate'
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        response = super().get_paginated_response(data)
+        if self.with_estimate:
+            response.data['count'] = estimate_count(self.model)
+        return response
+
+    def get_paginated_response_schema(self, schema):
+        schema = super().get_paginated_response_schema(schema)
+        schema['properties']['count'] = {'type': 'integer', 'nullable': True}
+        return schema
+
+
+class DateJoinedCursorPagination(CreatedAtCursorPagination):
+    ordering = ('-date_joined', '-id')
+
+
+class OrderCursorPagination(CreatedAtCursorPagination):
+    # Catalog order as set by the admins
+    ordering = ('order', 'id')
@@ -1,9 +1,10 @@
 from rest_framework.permissions import BasePermission
 
-from apps.models import Lesson, UserCourse
+from apps.cache import get_enrolled_course_ids
+from apps.models import Lesson
 
 
 class IsJoinedCoursePermission(BasePermission):
 
     def has_object_permission(self, request, view, obj: Lesson):
-        return UserCourse.objects.filter(user=request.user, course_id=obj.module.course_id).exists()
+        return obj.module.course_id in get_enrolled_course_ids(request.user.pk)
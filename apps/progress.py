@@ -0,0 +1,134 @@
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models import Exists, F, OuterRef, Value
+from django.db.models.functions import Greatest
+
+from apps.models import Lesson, Module, Task, UserCourse, UserCourseProgress, UserLesson, UserTask
+
+FINISHED = UserLesson.StatusChoices.FINISHED
+
+
+def task_course_id(task_id):
+    return Task.objects.filter(pk=task_id).values_list('lesson__module__course_id', flat=True).first()
+
+
+def next_lesson_id(user_id, course_id, using=DEFAULT_DB_ALIAS):
+    return UserLesson.objects.using(using).filter(user_id=user_id, lesson__module__course_id=course_id).exclude(
+        status=FINISHED).order_by('lesson__module__order', 'lesson__order').values_list('lesson_id', flat=True).first()
+
+
+def refresh(user_id, course_id, using=DEFAULT_DB_ALIAS):
+    values = {
+        'finished_lessons': UserLesson.objects.using(using).filter(
+            user_id=user_id, lesson__module__course_id=course_id, status=FINISHED).count(),
+        'finished_tasks': UserTask.objects.using(using).filter(
+            user_id=user_id, task__lesson__module__course_id=course_id, finished=True).count(),
+        'next_lesson_id': next_lesson_id(user_id, course_id, using),
+    }
+    UserCourseProgress.objects.using(using).update_or_create(user_id=user_id, course_id=course_id, defaults=values)
+
+
+def _apply(user_id, course_id, field, delta, **values):
+    values[field] = Greatest(F(field) + delta, Value(0))
+    updated = UserCourseProgress.objects.filter(user_id=user_id, course_id=course_id).update(**values)
+    if not updated and delta > 0:
+        # No materialized row yet (enrolled before progress existed), build it from scratch
+        if UserCourse.objects.filter(user_id=user_id, course_id=course_id).exists():
+            refresh(user_id, course_id)
+
+
+def lesson_changed(user_id, course_id, delta):
+    _apply(user_id, course_id, 'finished_lessons', delta, next_lesson_id=next_lesson_id(user_id, course_id))
+
+
+def task_changed(user_id, course_id, delta):
+    _apply(user_id, course_id, 'finished_tasks', delta)
+
+
+REBUILD_SQL = '''
+INSERT INTO {progress} (id, user_id, course_id, finished_lessons, finished_tasks, next_lesson_id,
+                        created_at, update_at)
+SELECT gen_random_uuid(), uc.user_id, uc.course_id, COALESCE(fl.total, 0), COALESCE(ft.total, 0), nl.lesson_id,
+       now(), now()
+FROM {user_course} uc
+LEFT JOIN (
+    SELECT ul.user_id, m.course_id, count(*) AS total
+    FROM {user_lesson} ul
+    JOIN {lesson} l ON l.id = ul.lesson_id
+    JOIN {module} m ON m.id = l.module_id
+    WHERE ul.status = %(finished)s
+    GROUP BY ul.user_id, m.course_id
+) fl ON fl.user_id = uc.user_id AND fl.course_id = uc.course_id
+LEFT JOIN (
+    SELECT ut.user_id, m.course_id, count(*) AS total
+    FROM {user_task} ut
+    JOIN {task} t ON t.id = ut.task_id
+    JOIN {lesson} l ON l.id = t.lesson_id
+    JOIN {module} m ON m.id = l.module_id
+    WHERE ut.finished
+    GROUP BY ut.user_id, m.course_id
+) ft ON ft.user_id = uc.user_id AND ft.course_id = uc.course_id
+LEFT JOIN (
+    SELECT DISTINCT ON (ul.user_id, m.course_id) ul.user_id, m.course_id, ul.lesson_id
+    FROM {user_lesson} ul
+    JOIN {lesson} l ON l.id = ul.lesson_id
+    JOIN {module} m ON m.id = l.module_id
+    WHERE ul.status <> %(finished)s
+    ORDER BY ul.user_id, m.course_id, m."order", l."order"
+) nl ON nl.user_id = uc.user_id AND nl.course_id = uc.course_id
+{where}
+ON CONFLICT (user_id, course_id) DO UPDATE SET
+    finished_lessons = EXCLUDED.finished_lessons,
+    finished_tasks = EXCLUDED.finished_tasks,
+    next_lesson_id = EXCLUDED.next_lesson_id,
+    update_at = EXCLUDED.update_at
+'''
+
+PRUNE_SQL = '''
+DELETE FROM {progress} p
+WHERE NOT EXISTS (SELECT 1 FROM {user_course} uc WHERE uc.user_id = p.user_id AND uc.course_id = p.course_id)
+{course}
+'''
+
+
+def rebuild(course_id=None, missing_only=False, using=DEFAULT_DB_ALIAS):
+    """
+    Recompute every progress row; set-based on PostgreSQL, row by row elsewhere. With
+    missing_only, only enrollments without a row get one, which is cheap enough for every deploy.
+    """
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        enrollments = UserCourse.objects.using(using)
+        if course_id:
+            enrollments = enrollments.filter(course_id=course_id)
+        if missing_only:
+            enrollments = enrollments.exclude(Exists(UserCourseProgress.objects.using(using).filter(
+                user_id=OuterRef('user_id'), course_id=OuterRef('course_id'))))
+        rows = 0
+        for user_id, enrolled_course_id in enrollments.values_list('user_id', 'course_id').iterator():
+            refresh(user_id, enrolled_course_id, using)
+            rows += 1
+        return rows
+
+    tables = {
+        'progress': UserCourseProgress._meta.db_table,
+        'user_course': UserCourse._meta.db_table,
+        'user_lesson': UserLesson._meta.db_table,
+        'user_task': UserTask._meta.db_table,
+        'lesson': Lesson._meta.db_table,
+        'module': Module._meta.db_table,
+        'task': Task._meta.db_table,
+    }
+    params = {'finished': FINISHED, 'course_id': course_id}
+    conditions = ['uc.course_id = %(course_id)s'] if course_id else []
+    if missing_only:
+        conditions.append('NOT EXISTS (SELECT 1 FROM {progress} p '
+                          'WHERE p.user_id = uc.user_id AND p.course_id = uc.course_id)'.format(**tables))
+    where = f'WHERE {" AND ".join(conditions)}' if conditions else ''
+    with connection.cursor() as cursor:
+        cursor.execute(REBUILD_SQL.format(where=where, **tables), params)
+        rows = cursor.rowcount
+        # Unenrolling deletes the row already; pruning is for full rebuilds, never for the deploy-time backfill
+        if not missing_only:
+            course = 'AND p.course_id = %(course_id)s' if course_id else ''
+            cursor.execute(PRUNE_SQL.format(course=course, **tables), params)
+    return rows
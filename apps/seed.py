@@ -0,0 +1,164 @@
+import datetime
+import itertools
+import random
+import uuid
+
+from django.contrib.auth.hashers import make_password
+from django.utils import timezone
+
+from apps.enrollment import BATCH_SIZE, chunked
+from apps.models import (Course, Device, Lesson, Module, Payment, Task,
+                         TaskChat, User, UserCourse, UserCourseProgress,
+                         UserLesson, UserModule, UserTask, Video, )
+
+PASSWORD = 'password'
+STUDENT_CHUNK = 1000
+# Share of finished tasks that get a chat thread
+CHAT_RATE = 0.3
+
+BLOCKED = UserLesson.StatusChoices.BLOCKED
+IN_PROG = UserLesson.StatusChoices.IN_PROG
+FINISHED = UserLesson.StatusChoices.FINISHED
+
+
+def bulk_create(model, objs):
+    model.objects.bulk_create(objs, batch_size=BATCH_SIZE)
+
+
+def phone_number(index):
+    return f'99{index:07d}'
+
+
+def seed(courses=1, modules=2, lessons=3, videos=2, tasks=2, students=1, enrollments=1, payments=0, chats=0,
+         seed=0, write=bulk_create):
+    """
+    Create a deterministic catalog (courses x modules x lessons, each lesson with its videos
+    and tasks) and students with progress, payments and task chat messages.
+
+    Students take 1..enrollments courses (most take one), picked with a Zipf-like skew
+    towards the first courses; progress is skewed towards the start of a course, payments
+    and chats average the given number per student and per finished task.
+    Rows go through write(model, objs), one call per model and chunk.
+    """
+    rng = random.Random(seed)
+
+    def new_id():
+        return uuid.UUID(int=rng.getrandbits(128), version=4)
+
+    password = make_password(PASSWORD)
+    now = timezone.now()
+    today = now.date()
+
+    admin = User(id=new_id(), phone_number=phone_number(0), username='admin', password=password,
+                 type=User.UserType.ADMIN, is_staff=True, is_superuser=True)
+    teacher = User(id=new_id(), phone_number=phone_number(1), username='teacher', password=password,
+                   type=User.UserType.TEACHER)
+    write(User, [admin, teacher])
+
+    plans = []
+    course_rows, module_rows, lesson_rows, video_rows, task_rows = [], [], [], [], []
+    for c in range(courses):
+        course = Course(id=new_id(), title=f'Course {c}', order=c, url=f'https://example.com/courses/{c}',
+                        modul_count=modules, lesson_count=modules * lessons, task_count=modules * lessons * tasks)
+        course_rows.append(course)
+        plan = {'id': course.id, 'modules': [], 'lessons': [], 'tasks': {}}
+        for m in range(modules):
+            module = Module(id=new_id(), course=course, title=f'Module {c}.{m}', slug=f'module-{c}-{m}', order=m,
+                            learning_type='online', has_in_tg='0', support_day=today,
+                            lesson_count=lessons, task_count=lessons * tasks)
+            module_rows.append(module)
+            plan['modules'].append(module.id)
+            for n in range(lessons):
+                lesson = Lesson(id=new_id(), module=module, title=f'Lesson {c}.{m}.{n}', slug=f'lesson-{c}-{m}-{n}',
+                                order=n, url=f'https://example.com/lessons/{c}/{m}/{n}', is_deleted=False,
+                                video_count=videos)
+                lesson_rows.append(lesson)
+                plan['lessons'].append((lesson.id, module.id))
+                plan['tasks'][lesson.id] = []
+                for v in range(videos):
+                    video_rows.append(Video(id=new_id(), lesson=lesson, title=f'Video {v}', description='',
+                                            media_code=f'{c}-{m}-{n}-{v}', media_url='', file='videos/video/seed.mp4',
+                                            order=v))
+                for t in range(tasks):
+                    task = Task(id=new_id(), lesson=lesson, title=f'Task {t}', description='', status='',
+                                user_task_list='', last_time=now + datetime.timedelta(days=30), order=t,
+                                task_number=t, must_complete=t == 0)
+                    task_rows.append(task)
+                    plan['tasks'][lesson.id].append(task.id)
+        plans.append(plan)
+    for model, rows in ((Course, course_rows), (Module, module_rows), (Lesson, lesson_rows), (Video, video_rows),
+                        (Task, task_rows)):
+        for chunk in chunked(rows, BATCH_SIZE):
+            write(model, chunk)
+
+    popularity = list(itertools.accumulate(1 / (c + 1) for c in range(courses)))
+
+    def pick_courses():
+        count = 1
+        while count < min(enrollments, courses) and rng.random() < 0.35:
+            count += 1
+        picked = []
+        while len(picked) < count:
+            index = rng.choices(range(courses), cum_weights=popularity)[0]
+            if index not in picked:
+                picked.append(index)
+        return picked
+
+    longest_thread = max(1, round(2 * chats / CHAT_RATE) - 1)
+    first = None
+    for chunk in chunked(range(students), STUDENT_CHUNK):
+        rows = {model: [] for model in (User, Device, Payment, UserCourse, UserCourseProgress, UserModule, UserLesson,
+                                        UserTask, TaskChat)}
+        for s in chunk:
+            student = User(id=new_id(), phone_number=phone_number(s + 2), username=f'student{s}', password=password,
+                           first_name='Student', last_name=str(s))
+            rows[User].append(student)
+            rows[Device].append(Device(id=new_id(), user=student, title='Linux, Firefox, 120, Desktop'))
+            for _ in range(rng.randint(0, 2 * payments)):
+                rows[Payment].append(Payment(id=new_id(), user=student, reason='Course payment', expend='',
+                                             balance=rng.choice((290000, 490000, 990000)), income=True,
+                                             processed_date=now - datetime.timedelta(days=rng.randint(0, 365))))
+            for index in pick_courses():
+                plan = plans[index]
+                if first is None:
+                    first = student.id, plan
+                total = len(plan['lessons'])
+                done = min(total, int(total * rng.betavariate(0.9, 1.8)))
+                finished_tasks = 0
+                rows[UserCourse].append(UserCourse(id=new_id(), user=student, course_id=plan['id'],
+                                                   status=FINISHED if done == total else IN_PROG))
+                current_module = plan['lessons'][done][1] if done < total else None
+                for module_id in plan['modules']:
+                    status = IN_PROG if module_id == current_module else BLOCKED
+                    rows[UserModule].append(UserModule(id=new_id(), user=student, module_id=module_id, status=status))
+                for position, (lesson_id, module_id) in enumerate(plan['lessons']):
+                    status = FINISHED if position < done else IN_PROG if position == done else BLOCKED
+                    rows[UserLesson].append(UserLesson(id=new_id(), user=student, lesson_id=lesson_id, status=status))
+                    if position >= done:
+                        continue
+                    for task_id in plan['tasks'][lesson_id]:
+                        rows[UserTask].append(UserTask(id=new_id(), user=student, task_id=task_id, finished=True))
+                        finished_tasks += 1
+                        if chats and rng.random() < CHAT_RATE:
+                            for message in range(rng.randint(1, longest_thread)):
+                                rows[TaskChat].append(TaskChat(id=new_id(), user=student, task_id=task_id,
+                                                               text=f'Message {message}', file='', voice=''))
+                next_lesson = plan['lessons'][done][0] if done < total else None
+                rows[UserCourseProgress].append(UserCourseProgress(
+                    id=new_id(), user=student, course_id=plan['id'], finished_lessons=done,
+                    finished_tasks=finished_tasks, next_lesson_id=next_lesson))
+        for model, objs in rows.items():
+            for batch in chunked(objs, BATCH_SIZE):
+                write(model, batch)
+
+    student, plan = first if first else (None, plans[0])
+    return {
+        'admin': admin.id,
+        'teacher': teacher.id,
+        'student': student,
+        'course': plan['id'],
+        'module': plan['modules'][0],
+        'lesson': plan['lessons'][0][0],
+        'task': plan['tasks'][plan['lessons'][0][0]][0],
+        'video': video_rows[0].id if video_rows else None,
+    }
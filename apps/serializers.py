@@ -3,13 +3,16 @@ from django.contrib.auth.hashers import make_password
 from django.utils.translation import gettext_lazy as _
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
-from rest_framework.fields import CharField
+from rest_framework.fields import (CharField, FileField, IntegerField, ListField,
+                                   ReadOnlyField, SerializerMethodField, UUIDField, )
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.serializers import ModelSerializer, Serializer
 
+from apps import unread
 from apps.models import (Course, DeletedUser, Device, Lesson, Module, Task,
-                         User, UserCourse, UserLesson, UserModule, UserTask,
-                         Video, )
+                         TaskChat, User, UserCourse, UserCourseProgress,
+                         UserLesson, UserModule, UserTask, Video,
+                         progress_percent, )
 
 
 class SingleDeviceLogin(Serializer):
@@ -119,6 +122,12 @@ class UserModuleModelSerializer(ModelSerializer):
         model = UserModule
         fields = '__all__'
 
+    def to_representation(self, instance: UserModule):
+        representation = super().to_representation(instance)
+        representation['course_progress'] = progress_percent(getattr(instance, 'finished_lessons', None) or 0,
+                                                             getattr(instance, 'course_lesson_count', 0))
+        return representation
+
 
 class UserCourseTeacherModelSerializer(ModelSerializer):
 
@@ -240,6 +249,25 @@ class CourseModelSerializer(ModelSerializer):
         fields = 'id', 'title', 'modul_count',
 
 
+class CourseTreeModelSerializer(ModelSerializer):
+    modules = ModuleModelSerializer(source='module_set', many=True, read_only=True)
+
+    class Meta:
+        model = Course
+        fields = 'id', 'title', 'modul_count', 'lesson_count', 'task_count', 'modules'
+
+
+class UserCourseProgressModelSerializer(ModelSerializer):
+    id = UUIDField(source='course_id')
+    title = CharField(source='course.title')
+    modul_count = IntegerField(source='course.modul_count')
+    percent = ReadOnlyField()
+
+    class Meta:
+        model = UserCourseProgress
+        fields = 'id', 'title', 'modul_count', 'finished_lessons', 'finished_tasks', 'next_lesson', 'percent'
+
+
 class CourseCRUDSerializer(ModelSerializer):
     # teacher = UserModelSerializer(read_only=True)
 
@@ -254,10 +282,38 @@ class DeviceModelSerializer(ModelSerializer):
         fields = "__all__"
 
 
+class TaskChatModelSerializer(ModelSerializer):
+    class Meta:
+        model = TaskChat
+        fields = 'id', 'user', 'text', 'file', 'voice', 'created_at'
+
+
 class CheckPhoneModelSerializer(Serializer):
     phone_number = CharField(max_length=20, write_only=True)
 
 
+class EnrollmentSerializer(Serializer):
+    users = ListField(child=UUIDField(), required=False, write_only=True)
+    file = FileField(required=False, write_only=True, help_text='CSV with phone numbers in the first column')
+
+    def validate_users(self, user_ids):
+        # apps.enrollment imports apps.cache, which imports this module
+        from apps.enrollment import CHUNK_SIZE, chunked
+
+        existing = set()
+        for chunk in chunked(user_ids, CHUNK_SIZE):
+            existing.update(User.objects.filter(id__in=chunk).values_list('id', flat=True))
+        unknown = [str(user_id) for user_id in dict.fromkeys(user_ids) if user_id not in existing]
+        if unknown:
+            raise ValidationError(f'Unknown users: {", ".join(unknown)}')
+        return user_ids
+
+    def validate(self, attrs):
+        if not attrs.get('users') and not attrs.get('file'):
+            raise ValidationError('Must include "users" or "file".')
+        return attrs
+
+
 class DeletedUserSerializer(ModelSerializer):
     class Meta:
         model = DeletedUser
@@ -354,6 +410,14 @@ class CustomAuthTokenSerializer(serializers.Serializer):
 
 
 class MyUserModelSerializer(ModelSerializer):
+    # The column lags behind by up to one flush; the live count is in Redis
+    not_read_message_count = SerializerMethodField()
+
     class Meta:
         model = User
-        fields = 'first_name', 'last_name', 'photo'
+        fields = 'first_name', 'last_name', 'photo', 'not_read_message_count'
+
+    def get_not_read_message_count(self, user):
+        if 'unread' in self.context:
+            return self.context['unread']
+        return unread.total(user.pk)
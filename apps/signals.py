@@ -1,21 +1,149 @@
-from django.db import models
+from django.db import transaction
 from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 
-from .models import Lesson
+from apps import counters, progress, unlock
+from apps.cache import (CATALOG_VERSION_KEY, bump_course_version, bump_version,
+                        invalidate_enrollments, invalidate_local, )
+from apps.models import (Course, Lesson, Module, Task, User, UserCourse,
+                         UserCourseProgress, UserLesson, UserTask, Video, )
 
 
+def _course_id(instance):
+    if isinstance(instance, Course):
+        return instance.pk
+    if isinstance(instance, Module):
+        return instance.course_id
+    if isinstance(instance, Lesson):
+        return counters.module_course_id(instance.module_id)
+    return counters.lesson_parent_ids(instance.lesson_id)[1]
+
+
+@receiver(post_save, sender=Course)
+@receiver(post_save, sender=Module)
 @receiver(post_save, sender=Lesson)
-def update_lesson_count(instance, created,):
-    if created:
-        instance.course.lesson_count += 1
-    else:
-        instance.course.lesson_count = models.F('lesson_count') - 1
-    instance.course.save()
+@receiver(post_save, sender=Video)
+@receiver(post_save, sender=Task)
+@receiver(post_delete, sender=Course)
+@receiver(post_delete, sender=Module)
+@receiver(post_delete, sender=Lesson)
+@receiver(post_delete, sender=Video)
+@receiver(post_delete, sender=Task)
+def invalidate_course_tree(sender, instance, **kwargs):
+    course_id = _course_id(instance)
+    is_course = isinstance(instance, Course)
+
+    def bump():
+        if course_id:
+            bump_course_version(course_id)
+        if is_course:
+            bump_version(CATALOG_VERSION_KEY)
 
+    # After commit, or a concurrent reader could cache the old rows under the new version
+    transaction.on_commit(bump)
 
+
+@receiver(post_save, sender=Course)
+@receiver(post_save, sender=Module)
+@receiver(post_save, sender=Lesson)
+@receiver(post_save, sender=Video)
+@receiver(post_save, sender=Task)
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=Course)
+@receiver(post_delete, sender=Module)
 @receiver(post_delete, sender=Lesson)
-def decrease_lesson_count(instance,):
-    instance.course.lesson_count = models.F('lesson_count') - 1
-    instance.course.save()
+@receiver(post_delete, sender=Video)
+@receiver(post_delete, sender=Task)
+@receiver(post_delete, sender=User)
+def invalidate_local_caches(sender, instance, **kwargs):
+    if isinstance(instance, User):
+        invalidate_local(f'user:{instance.pk}:')
+    elif course_id := _course_id(instance):
+        invalidate_local(f'course:{course_id}:')
+
+
+def _update_counters(instance, delta):
+    if isinstance(instance, Module):
+        counters.increment(Course, instance.course_id, 'modul_count', delta)
+    elif isinstance(instance, Lesson):
+        counters.increment(Module, instance.module_id, 'lesson_count', delta)
+        counters.increment(Course, counters.module_course_id(instance.module_id), 'lesson_count', delta)
+    elif isinstance(instance, Task):
+        module_id, course_id = counters.lesson_parent_ids(instance.lesson_id)
+        counters.increment(Module, module_id, 'task_count', delta)
+        counters.increment(Course, course_id, 'task_count', delta)
+    elif isinstance(instance, Video):
+        counters.increment(Lesson, instance.lesson_id, 'video_count', delta)
+
+
+@receiver(post_save, sender=Module)
+@receiver(post_save, sender=Lesson)
+@receiver(post_save, sender=Task)
+@receiver(post_save, sender=Video)
+def increase_counters(sender, instance, created, raw=False, **kwargs):
+    # Fixtures carry their own counter values
+    if created and not raw:
+        _update_counters(instance, 1)
+
+
+@receiver(post_delete, sender=Module)
+@receiver(post_delete, sender=Lesson)
+@receiver(post_delete, sender=Task)
+@receiver(post_delete, sender=Video)
+def decrease_counters(sender, instance, **kwargs):
+    _update_counters(instance, -1)
+
+
+@receiver(post_save, sender=UserCourse)
+def create_course_progress(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        UserCourseProgress.objects.get_or_create(user_id=instance.user_id, course_id=instance.course_id)
+
+
+@receiver(post_delete, sender=UserCourse)
+def delete_course_progress(sender, instance, **kwargs):
+    UserCourseProgress.objects.filter(user_id=instance.user_id, course_id=instance.course_id).delete()
+
+
+@receiver(post_save, sender=UserCourse)
+@receiver(post_delete, sender=UserCourse)
+def invalidate_user_enrollments(sender, instance, **kwargs):
+    transaction.on_commit(lambda: invalidate_enrollments(instance.user_id))
+
+
+def _changed(instance, field, finished_value):
+    # +1 when a row becomes finished, -1 when it stops being finished
+    loaded = getattr(instance, '_loaded_values', {})
+    was_finished = loaded.get(field) == finished_value
+    is_finished = getattr(instance, field) == finished_value
+    loaded[field] = getattr(instance, field)
+    instance._loaded_values = loaded
+    return int(is_finished) - int(was_finished)
+
+
+@receiver(post_save, sender=UserLesson)
+def update_lesson_progress(sender, instance, raw=False, **kwargs):
+    delta = _changed(instance, 'status', UserLesson.StatusChoices.FINISHED)
+    if delta and not raw:
+        progress.lesson_changed(instance.user_id, counters.lesson_parent_ids(instance.lesson_id)[1], delta)
+
+
+@receiver(post_save, sender=UserTask)
+def update_task_progress(sender, instance, raw=False, **kwargs):
+    delta = _changed(instance, 'finished', True)
+    if delta and not raw:
+        progress.task_changed(instance.user_id, progress.task_course_id(instance.task_id), delta)
+        if delta > 0:
+            unlock.task_finished(instance.user_id, instance.task_id)
+
+
+@receiver(post_delete, sender=UserLesson)
+def remove_lesson_progress(sender, instance, **kwargs):
+    if instance.status == UserLesson.StatusChoices.FINISHED:
+        progress.lesson_changed(instance.user_id, counters.lesson_parent_ids(instance.lesson_id)[1], -1)
+
 
+@receiver(post_delete, sender=UserTask)
+def remove_task_progress(sender, instance, **kwargs):
+    if instance.finished:
+        progress.task_changed(instance.user_id, progress.task_course_id(instance.task_id), -1)
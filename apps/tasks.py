@@ -0,0 +1,13 @@
+from celery import shared_task
+
+from apps import counters, unread
+
+
+@shared_task
+def reconcile_counters():
+    return counters.reconcile()
+
+
+@shared_task
+def flush_unread_counts():
+    return unread.flush()
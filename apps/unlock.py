@@ -0,0 +1,159 @@
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models.functions import Now
+from django.utils import timezone
+
+from apps import progress
+from apps.enrollment import chunked
+from apps.models import (Course, Lesson, Task, UserCourse, UserLesson,
+                         UserModule, UserTask, )
+
+BLOCKED = UserLesson.StatusChoices.BLOCKED
+IN_PROG = UserLesson.StatusChoices.IN_PROG
+FINISHED = UserLesson.StatusChoices.FINISHED
+
+
+def _lesson_done(user_id, lesson_id):
+    finished = UserTask.objects.filter(user_id=user_id, finished=True, task__lesson_id=lesson_id).values('task_id')
+    return not Task.objects.filter(lesson_id=lesson_id, must_complete=True).exclude(pk__in=finished).exists()
+
+
+def finish_lesson(user_id, lesson_id):
+    """
+    Finish a lesson whose required tasks are all done and open the one after it; a lesson
+    without required tasks only finishes when the student says so. Returns whether it finished.
+    """
+    lesson = Lesson.objects.filter(pk=lesson_id).values(
+        'module_id', 'order', 'module__order', 'module__course_id').first()
+    if lesson is None or not _lesson_done(user_id, lesson_id):
+        return False
+    now = Now()
+    if not UserLesson.objects.filter(user_id=user_id, lesson_id=lesson_id).exclude(status=FINISHED).update(
+            status=FINISHED, update_at=now):
+        return False
+    module_id, course_id = lesson['module_id'], lesson['module__course_id']
+
+    # The next lesson of this module, else the first one of a later module
+    next_lesson = Lesson.objects.filter(module_id=module_id, order__gt=lesson['order']).order_by('order').values(
+        'id', 'module_id').first() or Lesson.objects.filter(
+        module__course_id=course_id, module__order__gt=lesson['module__order']).order_by(
+        'module__order', 'order').values('id', 'module_id').first()
+    if next_lesson:
+        UserLesson.objects.filter(user_id=user_id, lesson_id=next_lesson['id'], status=BLOCKED).update(
+            status=IN_PROG, update_at=now)
+
+    if not UserLesson.objects.filter(user_id=user_id, lesson__module_id=module_id).exclude(status=FINISHED).exists():
+        UserModule.objects.filter(user_id=user_id, module_id=module_id).exclude(status=FINISHED).update(
+            status=FINISHED, update_at=now)
+    if next_lesson and next_lesson['module_id'] != module_id:
+        UserModule.objects.filter(user_id=user_id, module_id=next_lesson['module_id'], status=BLOCKED).update(
+            status=IN_PROG, update_at=now)
+    if next_lesson is None and not UserModule.objects.filter(
+            user_id=user_id, module__course_id=course_id).exclude(status=FINISHED).exists():
+        UserCourse.objects.filter(user_id=user_id, course_id=course_id).exclude(status=FINISHED).update(
+            status=FINISHED, update_at=now)
+
+    # update() skips the progress signals, so recount once
+    progress.refresh(user_id, course_id)
+    return True
+
+
+def task_finished(user_id, task_id):
+    """Advance the student after a must-complete task of one lesson is finished."""
+    lesson_id = Task.objects.filter(pk=task_id, must_complete=True).values_list('lesson_id', flat=True).first()
+    if lesson_id:
+        finish_lesson(user_id, lesson_id)
+
+
+def _course_plan(course_id):
+    lessons = list(Lesson.objects.filter(module__course_id=course_id).order_by('module__order', 'order').values_list(
+        'id', 'module_id'))
+    required = defaultdict(set)
+    for lesson_id, task_id in Task.objects.filter(lesson__module__course_id=course_id, must_complete=True).values_list(
+            'lesson_id', 'id'):
+        required[lesson_id].add(task_id)
+    return lessons, required
+
+
+def _statuses(lessons, required, finished_tasks, current):
+    """Walk the lessons in course order; a lesson is open once the one before it is done."""
+    lesson_statuses, module_statuses = {}, {}
+    unlocked = True
+    for lesson_id, module_id in lessons:
+        if required[lesson_id]:
+            done = required[lesson_id] <= finished_tasks
+        else:
+            # Nothing to complete: done only once the student finished it
+            done = current.get(lesson_id) == FINISHED
+        status = FINISHED if done else IN_PROG if unlocked else BLOCKED
+        lesson_statuses[lesson_id] = status
+        unlocked = done
+
+        # A module with lessons in different states is in progress
+        previous = module_statuses.setdefault(module_id, status)
+        if previous != status:
+            module_statuses[module_id] = IN_PROG
+    return lesson_statuses, module_statuses
+
+
+def reevaluate_course(course_id, chunk_size=500):
+    """
+    Recompute UserLesson/UserModule/UserCourse statuses for every student of a course,
+    e.g. after its structure changed.
+    """
+    lessons, required = _course_plan(course_id)
+    enrollments = UserCourse.objects.filter(course_id=course_id).only('id', 'user_id', 'status').iterator()
+    changed = 0
+    for chunk in chunked(enrollments, chunk_size):
+        user_ids = [enrollment.user_id for enrollment in chunk]
+        finished_tasks = defaultdict(set)
+        for user_id, task_id in UserTask.objects.filter(
+                user_id__in=user_ids, finished=True, task__lesson__module__course_id=course_id).values_list(
+                'user_id', 'task_id'):
+            finished_tasks[user_id].add(task_id)
+        user_lessons = defaultdict(dict)
+        for user_lesson in UserLesson.objects.filter(user_id__in=user_ids, lesson__module__course_id=course_id).only(
+                'id', 'user_id', 'lesson_id', 'status'):
+            user_lessons[user_lesson.user_id][user_lesson.lesson_id] = user_lesson
+        user_modules = defaultdict(dict)
+        for user_module in UserModule.objects.filter(user_id__in=user_ids, module__course_id=course_id).only(
+                'id', 'user_id', 'module_id', 'status'):
+            user_modules[user_module.user_id][user_module.module_id] = user_module
+
+        now = timezone.now()
+        lesson_updates, module_updates, course_updates = [], [], []
+        for enrollment in chunk:
+            rows = user_lessons[enrollment.user_id]
+            current = {lesson_id: row.status for lesson_id, row in rows.items()}
+            lesson_statuses, module_statuses = _statuses(lessons, required, finished_tasks[enrollment.user_id],
+                                                         current)
+            for lesson_id, row in rows.items():
+                if lesson_statuses.get(lesson_id, row.status) != row.status:
+                    row.status, row.update_at = lesson_statuses[lesson_id], now
+                    lesson_updates.append(row)
+            for module_id, row in user_modules[enrollment.user_id].items():
+                if module_statuses.get(module_id, row.status) != row.status:
+                    row.status, row.update_at = module_statuses[module_id], now
+                    module_updates.append(row)
+
+            # Finished like task_finished decides it: every lesson and module is finished
+            finished = bool(lessons) and all(status == FINISHED for status in lesson_statuses.values()) and all(
+                row.status == FINISHED for row in user_modules[enrollment.user_id].values())
+            status = FINISHED if finished else IN_PROG if enrollment.status == FINISHED else enrollment.status
+            if status != enrollment.status:
+                enrollment.status, enrollment.update_at = status, now
+                course_updates.append(enrollment)
+        with transaction.atomic():
+            UserLesson.objects.bulk_update(lesson_updates, ['status', 'update_at'], batch_size=1000)
+            UserModule.objects.bulk_update(module_updates, ['status', 'update_at'], batch_size=1000)
+            UserCourse.objects.bulk_update(course_updates, ['status', 'update_at'], batch_size=1000)
+        changed += len(lesson_updates) + len(module_updates) + len(course_updates)
+
+    progress.rebuild(course_id)
+    return changed
+
+
+def reevaluate(course_id=None):
+    course_ids = [course_id] if course_id else Course.objects.values_list('id', flat=True)
+    return {str(pk): reevaluate_course(pk) for pk in course_ids}
@@ -0,0 +1,75 @@
+from collections import defaultdict
+
+from django_redis import get_redis_connection
+
+from apps.models import User
+
+# unread:<user id> is a hash of task id -> unread messages in that task's room
+DIRTY_KEY = 'unread:dirty'
+FLUSH_BATCH = 1000
+
+
+def unread_key(user_id):
+    return f'unread:{user_id}'
+
+
+def redis():
+    return get_redis_connection('default')
+
+
+def record(messages):
+    """Count stored chat messages as unread for every room member except their sender."""
+    # apps.serializers imports this module; members pulls in apps.cache, which imports the serializers
+    from apps.chat.members import room_members
+
+    counts = defaultdict(lambda: defaultdict(int))
+    members = room_members({message.task_id for message in messages})
+    for message in messages:
+        for user_id in members[message.task_id]:
+            if user_id != message.user_id:
+                counts[user_id][message.task_id] += 1
+    if not counts:
+        return
+    with redis().pipeline(transaction=False) as pipe:
+        for user_id, tasks in counts.items():
+            for task_id, count in tasks.items():
+                pipe.hincrby(unread_key(user_id), str(task_id), count)
+        pipe.sadd(DIRTY_KEY, *map(str, counts))
+        pipe.execute()
+
+
+def mark_read(user_id, task_id):
+    with redis().pipeline(transaction=False) as pipe:
+        pipe.hdel(unread_key(user_id), str(task_id))
+        pipe.sadd(DIRTY_KEY, str(user_id))
+        pipe.hvals(unread_key(user_id))
+        return sum(map(int, pipe.execute()[-1]))
+
+
+def by_task(user_id):
+    return {task_id.decode(): int(count) for task_id, count in redis().hgetall(unread_key(user_id)).items()}
+
+
+def total(user_id):
+    return sum(map(int, redis().hvals(unread_key(user_id))))
+
+
+def flush(batch=FLUSH_BATCH):
+    """Write the live totals of changed users to User.not_read_message_count, one UPDATE per batch."""
+    connection = redis()
+    written = 0
+    while user_ids := connection.spop(DIRTY_KEY, batch):
+        user_ids = [user_id.decode() for user_id in user_ids]
+        with connection.pipeline(transaction=False) as pipe:
+            for user_id in user_ids:
+                pipe.hvals(unread_key(user_id))
+            totals = [sum(map(int, counts)) for counts in pipe.execute()]
+        users = [User(pk=user_id, not_read_message_count=count) for user_id, count in zip(user_ids, totals)]
+        try:
+            User.objects.bulk_update(users, ['not_read_message_count'])
+        except Exception:
+            # Put them back so the next run writes them
+            connection.sadd(DIRTY_KEY, *user_ids)
+            raise
+        written += len(users)
+    return written
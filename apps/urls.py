@@ -2,14 +2,16 @@ from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 from rest_framework_simplejwt.views import TokenRefreshView, TokenVerifyView
 
-from apps.views import (CheckPhoneAPIView, CourseAllListAPIView,
+from apps import async_views
+from apps.views import (CheckPhoneAPIView, CourseAllListAPIView, CourseEnrollAPIView, CourseTreeAPIView,
                         CustomTokenObtainPairView,
                         DeleteUserAPIView, DeviceModelListAPIView,
                         LessonRetrieveAPIView, CourseModelViewSet,
                         TeacherAPIView, UpdateUser, ModuleModulViewSet,
                         UpdateUserPassword, UserCourseListAPIView, TaskModulViewSet,
                         UserCourseTeacherListAPIView, UserCreateAPIView, VideoModulViewSet,
-                        UserModuleListAPIView, UserTaskRetrieveAPIView,
+                        UserModuleListAPIView, UserTaskRetrieveAPIView, UserLessonFinishAPIView, TaskChatListAPIView,
+                        TaskChatReadAPIView, UnreadCountAPIView,
                         CustomDurinLoginAPIView, MyUserModelAPIView, UserViewSet, LessonModelViewSet)
 
 router = DefaultRouter()
@@ -28,17 +30,28 @@ urlpatterns = [
     path('token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
     path('token/verify/', TokenVerifyView.as_view(), name='token_verify'),
     path('course/', CourseAllListAPIView.as_view(), name='course_list'),
+    path('course/<uuid:pk>/tree/', CourseTreeAPIView.as_view(), name='course_tree'),
+    path('course/<uuid:pk>/enroll/', CourseEnrollAPIView.as_view(), name='course_enroll'),
     path('user/device/', DeviceModelListAPIView.as_view(), name='device_model_list'),
     path('user/register/', UserCreateAPIView.as_view(), name='token_obtain_pair'),
     path('user/delete/', DeleteUserAPIView.as_view(), name='deleted_user'),
     path('user/my-courses/', UserCourseListAPIView.as_view(), name='user_course'),
     path('user/task/<uuid:lesson_id>', UserTaskRetrieveAPIView.as_view(), name='user_task'),
+    path('user/lesson/<uuid:lesson_id>/finish/', UserLessonFinishAPIView.as_view(), name='user_lesson_finish'),
     path('user/profile/', UpdateUser.as_view(), name='user_profile_update'),
     path('user/profile/password/', UpdateUserPassword.as_view(), name='user_profile_update'),
     path('user/module/', UserModuleListAPIView.as_view(), name='course_module'),
     path('course/module/<uuid:pk>/', UserCourseTeacherListAPIView.as_view(), name='course_module_teacher'),
     path('lesson/<uuid:pk>/', LessonRetrieveAPIView.as_view(), name='module_lesson'),
     # path('task/correct/<str:pk>',TaskCorrectAPIView.as_view(), name='task_correct'),
+    path('task/<uuid:task_id>/chat/', TaskChatListAPIView.as_view(), name='task_chat'),
+    path('task/<uuid:task_id>/chat/read/', TaskChatReadAPIView.as_view(), name='task_chat_read'),
+    path('user/unread/', UnreadCountAPIView.as_view(), name='user_unread'),
     path('teachers/', TeacherAPIView.as_view(), name='teachers'),
     path('user/get-me', MyUserModelAPIView.as_view(), name='user_get_me'),
+    # Async twins of the hot read endpoints, served without a thread per request under ASGI
+    path('async/course/', async_views.course_list, name='async_course_list'),
+    path('async/lesson/<uuid:pk>/', async_views.lesson_detail, name='async_lesson'),
+    path('async/user/task/<uuid:lesson_id>', async_views.user_tasks, name='async_user_task'),
+    path('async/user/get-me', async_views.get_me, name='async_user_get_me'),
 ]
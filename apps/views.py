@@ -1,29 +1,47 @@
+from django.db.models import Count, F, Max, OuterRef, Subquery
+from django.http import HttpResponse
 from django_filters.rest_framework import DjangoFilterBackend
 from durin.views import LoginView
 from rest_framework import status
 from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound, PermissionDenied
 from rest_framework.filters import SearchFilter, OrderingFilter
-from rest_framework.generics import (CreateAPIView, ListAPIView,
+from rest_framework.generics import (CreateAPIView, GenericAPIView, ListAPIView,
                                      RetrieveAPIView, RetrieveDestroyAPIView,
                                      UpdateAPIView, )
-from rest_framework.parsers import FormParser, MultiPartParser
+from rest_framework.parsers import FormParser, JSONParser, MultiPartParser
 from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework.response import Response
+from rest_framework.views import APIView
 from rest_framework.viewsets import GenericViewSet, ViewSet, ModelViewSet
+from rest_framework_simplejwt.authentication import JWTStatelessUserAuthentication
 from rest_framework_simplejwt.views import TokenObtainPairView
 
+from apps.cache import (CATALOG_VERSION_KEY, coalesce, get_course_tree,
+                        get_course_version, get_version, )
+from apps import unlock, unread
+from apps.chat.members import can_join
+from apps.db.router import pin_primary
+from apps.enrollment import enroll, phone_numbers_from_csv, user_ids_for_phone_numbers
 from apps.models import (Course, DeletedUser, Device, Lesson, Module, Task,
-                         User, UserLesson, UserModule, Video, )
+                         TaskChat, User, UserCourseProgress, UserLesson,
+                         UserModule, Video, )
+from apps.mixins import ConditionalGetMixin, DeferredCountersMixin
+from apps.paginations import (CreatedAtCursorPagination, DateJoinedCursorPagination,
+                              OrderCursorPagination, )
 from apps.permissions import IsJoinedCoursePermission
 from apps.serializers import (CheckPhoneModelSerializer, CourseModelSerializer,
                               DeletedUserSerializer, DeviceModelSerializer,
+                              EnrollmentSerializer,
                               LessonDetailModelSerializer,
                               LessonModelSerializer,
                               ModuleLessonModelSerializer,
                               ModuleModelSerializer, ModuleTeacherSerializer,
-                              RegisterModelSerializer, TaskModelSerializer,
+                              RegisterModelSerializer, TaskChatModelSerializer,
+                              TaskModelSerializer,
                               TeacherSerializer, UpdatePasswordUserSerializer,
                               UpdateUserSerializer,
+                              UserCourseProgressModelSerializer,
                               UserCourseTeacherModelSerializer,
                               UserModuleModelSerializer,
                               CustomAuthTokenSerializer, MyUserModelSerializer, UserModelSerializer,
@@ -54,7 +72,7 @@ from apps.serializers import (CheckPhoneModelSerializer, CourseModelSerializer,
 class TeacherAPIView(ListAPIView):
     queryset = User.objects.filter(type='teacher')
     serializer_class = TeacherSerializer
-    pagination_class = None
+    pagination_class = DateJoinedCursorPagination
 
 
 class UserViewSet(ModelViewSet):
@@ -63,6 +81,7 @@ class UserViewSet(ModelViewSet):
     filter = (OrderingFilter, SearchFilter)
     search_fields = ('phone_number',)
     permission_classes = [IsAuthenticated, ]
+    pagination_class = DateJoinedCursorPagination
 
     @action(detail=False, methods=['GET'], url_path='get-me')
     def get_me(self, request):
@@ -91,10 +110,24 @@ class UserCreateAPIView(CreateAPIView):
     serializer_class = RegisterModelSerializer
     pagination_class = None
 
+    def perform_create(self, serializer):
+        super().perform_create(serializer)
+        # The new user logs in and reads right away; keep them off lagging replicas
+        pin_primary(serializer.instance.pk)
+
 
-class CourseAllListAPIView(ListAPIView):
+class CourseAllListAPIView(ConditionalGetMixin, ListAPIView):
     queryset = Course.objects.all()
     serializer_class = CourseModelSerializer
+    pagination_class = OrderCursorPagination
+
+    def get_validators(self):
+        stats = Course.objects.aggregate(last_modified=Max('update_at'), count=Count('id'))
+        return (stats['count'],), stats['last_modified']
+
+    @coalesce(version=lambda view: get_version(CATALOG_VERSION_KEY))
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
 
 
 class CourseListAPIView(ListAPIView):
@@ -114,13 +147,13 @@ class CourseListAPIView(ListAPIView):
 
 
 class UserCourseListAPIView(ListAPIView):
-    queryset = Course.objects.all()
-    serializer_class = CourseModelSerializer
+    queryset = UserCourseProgress.objects.select_related('course')
+    serializer_class = UserCourseProgressModelSerializer
     permission_classes = [IsAuthenticated, ]
     pagination_class = None
 
     def get_queryset(self):
-        return super().get_queryset().filter(usercourse__user=self.request.user)
+        return super().get_queryset().filter(user=self.request.user).order_by('course__order')
 
 
 class ModuleListAPIView(ListAPIView):
@@ -149,11 +182,14 @@ class UserModuleListAPIView(ListAPIView):
         return self.request.user
 
     def get_queryset(self):
-        return super().get_queryset().filter(user=self.request.user)
+        finished_lessons = UserCourseProgress.objects.filter(
+            user_id=OuterRef('user_id'), course_id=OuterRef('module__course_id')).values('finished_lessons')
+        return super().get_queryset().filter(user=self.request.user).annotate(
+            finished_lessons=Subquery(finished_lessons), course_lesson_count=F('module__course__lesson_count'))
 
 
 class UserCourseTeacherListAPIView(ListAPIView):
-    queryset = UserModule.objects.all()
+    queryset = UserModule.objects.select_related('module__course')
     serializer_class = UserCourseTeacherModelSerializer
     pagination_class = None
 
@@ -177,11 +213,23 @@ class LessonListAPIView(ListAPIView):
         return super().get_queryset().filter(user=self.request.user)
 
 
-class LessonRetrieveAPIView(RetrieveAPIView):
-    queryset = Lesson.objects.all()
+class LessonRetrieveAPIView(ConditionalGetMixin, RetrieveAPIView):
+    queryset = Lesson.objects.select_related('module')
     permission_classes = [IsJoinedCoursePermission]
     serializer_class = LessonDetailModelSerializer
 
+    def get_object(self):
+        # Fetched once for the permission check and validators, reused by retrieve()
+        if not hasattr(self, '_lesson'):
+            self._lesson = super().get_object()
+        return self._lesson
+
+    def get_validators(self):
+        lesson = self.get_object()
+        videos = lesson.video_set.aggregate(last_modified=Max('update_at'), count=Count('id'))
+        last_modified = max(filter(None, (lesson.update_at, videos['last_modified'])))
+        return (lesson.update_at, videos['count'], videos['last_modified']), last_modified
+
 
 class ModuleViewSet(ViewSet):
     queryset = Module.objects.all()
@@ -190,11 +238,24 @@ class ModuleViewSet(ViewSet):
     pagination_class = None
 
     @action(['GET'], detail=True)
+    @coalesce(version=lambda view: get_course_version(view.kwargs['pk']))
     def module(self, request, pk=None):
-        modules = Module.objects.filter(course_id=pk)
+        modules = Module.objects.filter(course_id=pk).with_lessons()
         return Response(ModuleModelSerializer(modules, many=True).data)
 
 
+class CourseTreeAPIView(APIView):
+    # Stateless JWT auth keeps cache hits off the database entirely
+    authentication_classes = [JWTStatelessUserAuthentication]
+    permission_classes = [IsAuthenticated, ]
+
+    def get(self, request, pk):
+        content = get_course_tree(pk)
+        if content is None:
+            raise NotFound
+        return HttpResponse(content, content_type='application/json')
+
+
 class CourseAPIView(ListAPIView):
     queryset = Module.objects.all()
     serializer_class = ModuleTeacherSerializer
@@ -220,15 +281,41 @@ class ModuleLessonListAPIView(ListAPIView):
         return super().get_queryset().filter(user=self.request.user)
 
 
-class UserTaskRetrieveAPIView(ListAPIView):
+class UserLessonFinishAPIView(APIView):
+    # Lessons without required tasks only finish when the student marks them done
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, lesson_id):
+        if not UserLesson.objects.filter(user=request.user, lesson_id=lesson_id,
+                                         status=UserLesson.StatusChoices.IN_PROG).exists():
+            return Response({'msg': 'Bu lessonga access yoq', }, status=status.HTTP_403_FORBIDDEN)
+        if not unlock.finish_lesson(request.user.pk, lesson_id):
+            return Response({'msg': 'Majburiy tasklar tugatilmagan', }, status=status.HTTP_400_BAD_REQUEST)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class UserTaskRetrieveAPIView(ConditionalGetMixin, ListAPIView):
     permission_classes = [IsAuthenticated]
     lookup_url_kwarg = 'lesson_id'
 
+    def has_lesson_access(self):
+        if not hasattr(self, '_has_lesson_access'):
+            lesson_id = self.kwargs.get(self.lookup_url_kwarg)
+            self._has_lesson_access = UserLesson.objects.filter(user=self.request.user, lesson_id=lesson_id).exists()
+        return self._has_lesson_access
+
+    def get_validators(self):
+        if not self.has_lesson_access():
+            return None
+        stats = Task.objects.filter(lesson_id=self.kwargs.get(self.lookup_url_kwarg), must_complete=False).aggregate(
+            last_modified=Max('update_at'), count=Count('id'))
+        return (stats['count'],), stats['last_modified']
+
     def list(self, request, *args, **kwargs):
         lesson_id = self.kwargs.get(self.lookup_url_kwarg)
-        if not UserLesson.objects.filter(user=self.request.user, lesson_id=lesson_id).exists():
+        if not self.has_lesson_access():
             return Response({'msg': 'Bu lessonga access yoq', }, status=status.HTTP_403_FORBIDDEN)
-        qs = Task.objects.filter(lesson_id=lesson_id, must_complete=False)
+        qs = Task.objects.filter(lesson_id=lesson_id, must_complete=False).order_by('order')
         # qs = Task.objects.filter(lesson_id=lesson_id)
         # .annotate(
         #     is_open=Case(
@@ -305,7 +392,36 @@ class DeviceModelListAPIView(ListAPIView):
         return self.request.user
 
 
-class MyUserModelAPIView(RetrieveAPIView):
+class TaskChatListAPIView(ListAPIView):
+    # History of a task's chat room, newest first, for everyone who may join the room
+    serializer_class = TaskChatModelSerializer
+    permission_classes = [IsAuthenticated]
+    pagination_class = CreatedAtCursorPagination
+
+    def get_queryset(self):
+        task_id = self.kwargs['task_id']
+        if not can_join(self.request.user, task_id):
+            raise PermissionDenied
+        return TaskChat.objects.filter(task_id=task_id)
+
+
+class TaskChatReadAPIView(APIView):
+    # Read receipt: everything in the task's room up to now counts as read
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, task_id):
+        return Response({'not_read_message_count': unread.mark_read(request.user.pk, task_id)})
+
+
+class UnreadCountAPIView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        tasks = unread.by_task(request.user.pk)
+        return Response({'not_read_message_count': sum(tasks.values()), 'tasks': tasks})
+
+
+class MyUserModelAPIView(ConditionalGetMixin, RetrieveAPIView):
     queryset = User.objects.all()
     serializer_class = MyUserModelSerializer
     permission_classes = [IsAuthenticated, ]
@@ -314,6 +430,15 @@ class MyUserModelAPIView(RetrieveAPIView):
     def get_object(self):
         return self.request.user
 
+    def get_validators(self):
+        # User has no update_at; the already loaded fields are the validator
+        user = self.request.user
+        self.unread = unread.total(user.pk)
+        return (user.pk, user.first_name, user.last_name, user.photo.name, self.unread), None
+
+    def get_serializer_context(self):
+        return {**super().get_serializer_context(), 'unread': self.unread}
+
 
 class CheckPhoneAPIView(GenericViewSet):
     serializer_class = CheckPhoneModelSerializer
@@ -348,20 +473,37 @@ class CustomDurinLoginAPIView(LoginView):
         return serializer.validated_data["user"]
 
 
-class CourseModelViewSet(ModelViewSet):
+class CourseEnrollAPIView(GenericAPIView):
+    queryset = Course.objects.all()
+    serializer_class = EnrollmentSerializer
+    permission_classes = [IsAuthenticated, IsAdminUser]
+    parser_classes = [JSONParser, MultiPartParser, FormParser]
+
+    def post(self, request, *args, **kwargs):
+        course = self.get_object()
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        user_ids = serializer.validated_data.get('users', [])
+        if file := serializer.validated_data.get('file'):
+            user_ids = user_ids_for_phone_numbers(phone_numbers_from_csv(file))
+        return Response(enroll(course, user_ids), status=status.HTTP_201_CREATED)
+
+
+class CourseModelViewSet(DeferredCountersMixin, ModelViewSet):
     queryset = Course.objects.all()
     serializer_class = CourseCRUDSerializer
     permission_classes = [IsAuthenticated, IsAdminUser]
 
 
-class LessonModelViewSet(ModelViewSet):
-    queryset = Lesson.objects.all()
+class LessonModelViewSet(DeferredCountersMixin, ModelViewSet):
+    queryset = Lesson.objects.prefetch_related('video_set')
     serializer_class = LessonCRUDSerializer
     permission_classes = [IsAuthenticated, IsAdminUser]
+    pagination_class = CreatedAtCursorPagination
 
 
-class ModuleModulViewSet(ModelViewSet):
-    queryset = Module.objects.all()
+class ModuleModulViewSet(DeferredCountersMixin, ModelViewSet):
+    queryset = Module.objects.with_lessons()
     serializer_class = ModuleCRUDSerializer
     permission_classes = [IsAuthenticated, IsAdminUser]
     pagination_class = None
@@ -372,15 +514,15 @@ class ModuleModulViewSet(ModelViewSet):
     #     return Response(ModuleModelSerializer(modules, many=True).data)
 
 
-class TaskModulViewSet(ModelViewSet):
+class TaskModulViewSet(DeferredCountersMixin, ModelViewSet):
     queryset = Task.objects.all()
     serializer_class = TaskGRUDSerializer
     permission_classes = [IsAuthenticated, IsAdminUser]
-    pagination_class = None
+    pagination_class = CreatedAtCursorPagination
 
 
-class VideoModulViewSet(ModelViewSet):
+class VideoModulViewSet(DeferredCountersMixin, ModelViewSet):
     queryset = Video.objects.all()
     serializer_class = VideoGRUDSerializer
     permission_classes = [IsAuthenticated, IsAdminUser]
-    pagination_class = None
+    pagination_class = CreatedAtCursorPagination
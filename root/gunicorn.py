@@ -0,0 +1,29 @@
+import multiprocessing
+import os
+
+from prometheus_client import multiprocess
+
+# wsgi: classic sync workers for the DRF API; asgi: one event loop per core for websockets and
+# the async views. Sync DRF views under ASGI share one thread per worker, so the API stays on wsgi
+SERVER_MODE = os.getenv('SERVER_MODE', 'wsgi')
+
+if SERVER_MODE == 'asgi':
+    worker_class = 'root.workers.ChatUvicornWorker'
+    workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+else:
+    worker_class = 'sync'
+    workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+keepalive = 5
+# Room for reconnect storms after a deploy
+backlog = 4096
+timeout = 30
+graceful_timeout = 30
+# Recycle workers now and then so slow leaks can't grow forever
+max_requests = 10000
+max_requests_jitter = 1000
+
+
+def child_exit(server, worker):
+    # Drop the live gauges of a dead worker from /metrics
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        multiprocess.mark_process_dead(worker.pid)
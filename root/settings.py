@@ -1,4 +1,5 @@
 import os
+import sys
 from datetime import timedelta
 from pathlib import Path
 from django.utils.translation import gettext_lazy as _
@@ -41,12 +42,14 @@ INSTALLED_APPS = [
 
 
 MIDDLEWARE = [
+    'apps.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.locale.LocaleMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'apps.middleware.ReplicaRoutingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -76,16 +79,44 @@ AUTH_USER_MODEL = 'apps.User'
 WSGI_APPLICATION = 'root.wsgi.application'
 
 
+# Connections come from a per-process pool (apps.db); sizes depend on the kind of process
+DB_POOL_ROLE = os.getenv('DB_POOL_ROLE') or (
+    'worker' if 'celery' in os.path.basename(sys.argv[0]) else 'bot' if 'runbot' in sys.argv else 'web')
+DB_POOL_SIZES = {'web': (1, 4), 'worker': (1, 2), 'bot': (1, 2)}
+DB_POOL = {
+    'min_size': int(os.getenv('DB_POOL_MIN_SIZE', DB_POOL_SIZES[DB_POOL_ROLE][0])),
+    'max_size': int(os.getenv('DB_POOL_MAX_SIZE', DB_POOL_SIZES[DB_POOL_ROLE][1])),
+    'timeout': float(os.getenv('DB_POOL_TIMEOUT', 10)),
+    'max_idle': float(os.getenv('DB_POOL_MAX_IDLE', 300)),
+    'check_interval': float(os.getenv('DB_POOL_CHECK_INTERVAL', 30)),
+}
+
 DATABASES = {
     "default": {
-        "ENGINE": "django.db.backends.postgresql_psycopg2",
+        "ENGINE": "apps.db",
         "NAME": os.getenv('DB_NAME'),
         "USER": os.getenv('DB_USER'),
         "PASSWORD": os.getenv('DB_PASSWORD'),
         "HOST": os.getenv('DB_HOST'),
-        "PORT": os.getenv('DB_PORT')
+        "PORT": os.getenv('DB_PORT'),
+        # close() hands the connection back to the pool
+        "CONN_MAX_AGE": 0,
+        "OPTIONS": {"pool": DB_POOL} if os.getenv('DB_POOL', '1') != '0' else {},
     }
 }
+# Read replicas as host[:port] pairs, e.g. DB_REPLICAS=replica1:5432,replica2:5432
+DATABASE_REPLICAS = []
+for index, address in enumerate(filter(None, os.getenv('DB_REPLICAS', '').split(',')), 1):
+    host, _, port = address.strip().partition(':')
+    DATABASES[f'replica{index}'] = {**DATABASES['default'], 'HOST': host, 'PORT': port or DATABASES['default']['PORT'],
+                                    'TEST': {'MIRROR': 'default'}}
+    DATABASE_REPLICAS.append(f'replica{index}')
+DATABASE_ROUTERS = ['apps.db.router.ReplicaRouter']
+# Skip replicas further behind than this many seconds
+REPLICA_MAX_LAG = float(os.getenv('REPLICA_MAX_LAG', 2))
+REPLICA_LAG_CHECK_INTERVAL = float(os.getenv('REPLICA_LAG_CHECK_INTERVAL', 5))
+# How long a user reads from the primary after writing
+REPLICA_PIN_SECONDS = int(os.getenv('REPLICA_PIN_SECONDS', 10))
 
 
 AUTH_PASSWORD_VALIDATORS = [
@@ -149,7 +180,7 @@ REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'rest_framework_simplejwt.authentication.JWTAuthentication',
         'rest_framework.authentication.SessionAuthentication',
-    )
+    ),
 }
 
 
@@ -313,16 +344,67 @@ SWAGGER_SETTINGS = {
     }
 }
 
+REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/1')
+
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-        'LOCATION': 'unique-snowflake',
+        'BACKEND': 'apps.cache_backends.TwoTierCache',
+        'LOCATION': REDIS_URL,
+        'OPTIONS': {
+            'CLIENT_CLASS': 'django_redis.client.DefaultClient',
+            'L1_MAX_ENTRIES': int(os.getenv('CACHE_L1_MAX_ENTRIES', 10000)),
+            'L1_TIMEOUT': int(os.getenv('CACHE_L1_TIMEOUT', 60)),
+        },
     }
 }
 
+# Websocket fan-out between ASGI workers; a separate Redis database from the cache
+CHANNEL_REDIS_URL = os.getenv('CHANNEL_REDIS_URL', 'redis://localhost:6379/2')
+CHANNEL_LAYERS = {
+    'default': {
+        'BACKEND': 'channels_redis.core.RedisChannelLayer',
+        'CONFIG': {
+            # Extra keys go to the redis.asyncio connection pool of each event loop. That pool raises
+            # 'Too many connections' instead of waiting, so it is unbounded unless
+            # CHANNEL_REDIS_MAX_CONNECTIONS is set well above the handshakes a worker takes at once
+            'hosts': [{
+                'address': CHANNEL_REDIS_URL,
+                'health_check_interval': 30,
+                'socket_keepalive': True,
+                **({'max_connections': int(os.environ['CHANNEL_REDIS_MAX_CONNECTIONS'])}
+                   if os.getenv('CHANNEL_REDIS_MAX_CONNECTIONS') else {}),
+            }],
+            'prefix': 'chat:',
+            # Messages a slow consumer may have queued before new ones are dropped
+            'capacity': int(os.getenv('CHANNEL_CAPACITY', 1000)),
+            # Chat is live; undelivered messages are useless after a few seconds
+            'expiry': int(os.getenv('CHANNEL_EXPIRY', 10)),
+            # Must outlive the longest websocket connection, or members silently drop out of rooms
+            'group_expiry': int(os.getenv('CHANNEL_GROUP_EXPIRY', 24 * 60 * 60)),
+        },
+    },
+}
+
 CELERY_BROKER_URL = 'redis://localhost:16379/0'
+CELERY_BEAT_SCHEDULE = {
+    'reconcile-counters': {
+        'task': 'apps.tasks.reconcile_counters',
+        'schedule': timedelta(hours=1),
+    },
+    # Chat unread counts live in Redis; this copies them to User.not_read_message_count
+    'flush-unread-counts': {
+        'task': 'apps.tasks.flush_unread_counts',
+        'schedule': timedelta(seconds=int(os.getenv('UNREAD_FLUSH_SECONDS', 30))),
+    },
+}
 API_TOKEN = os.getenv('API_TOKEN')
 
+# Bearer token of the Prometheus scraper; /metrics answers 403 while it is unset
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+# Sampled cProfile dumps of requests at or above the rolling p99, e.g. PROFILE_SAMPLE_RATE=0.05
+PROFILE_DIR = os.getenv('PROFILE_DIR')
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', 0))
+
 DEFAULT_FILE_STORAGE = "minio_storage.storage.MinioMediaStorage"
 
 MINIO_STORAGE_ACCESS_KEY = os.getenv("MINIO_ACCESS_KEY")
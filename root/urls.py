@@ -8,6 +8,8 @@ from drf_yasg.generators import OpenAPISchemaGenerator
 from drf_yasg.views import get_schema_view
 from rest_framework import permissions
 
+from apps.metrics import metrics_view
+
 
 class BothHttpAndHttpsSchemaGenerator(OpenAPISchemaGenerator):
     def get_schema(self, request=None, public=False):
@@ -41,5 +43,6 @@ urlpatterns = i18n_patterns(
 ) + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT) + static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
 
 urlpatterns += [
-    path("i18n/", include("django.conf.urls.i18n"))
+    path("i18n/", include("django.conf.urls.i18n")),
+    path('metrics', metrics_view, name='metrics'),
 ]
@@ -0,0 +1,13 @@
+from uvicorn.workers import UvicornWorker
+
+
+class ChatUvicornWorker(UvicornWorker):
+    # Websocket chat keeps thousands of idle sockets per worker open
+    CONFIG_KWARGS = {
+        'loop': 'uvloop',
+        'http': 'httptools',
+        'ws': 'websockets',
+        'ws_ping_interval': 20.0,
+        'ws_ping_timeout': 20.0,
+        'ws_max_size': 64 * 1024,
+    }
@@ -1,8 +1,19 @@
 import os
 
 from aiogram import Bot, Dispatcher
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
 
 
 API_TOKEN = os.getenv('API_TOKEN')
 bot = Bot(API_TOKEN)
 dp = Dispatcher()
+
+
+@dp.update.outer_middleware()
+async def release_db_connections(handler, event, data):
+    # Hand the connection back to the pool after every update, like request_finished does for web requests
+    try:
+        return await handler(event, data)
+    finally:
+        await sync_to_async(close_old_connections)()